@@ -1,66 +1,250 @@
-import time, csv, os
-import requests
+import asyncio, csv, json, os, random, re, sys, time
+import aiohttp
 from bs4 import BeautifulSoup
+from score_feed import notify
+from matches import load_matches
+from metrics import Metrics
+from supervisor import HEARTBEAT_PREFIX, EXIT_ALREADY_RUNNING
+from scores import BallLog, next_innings, parse_score
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # no single-instance lock on Windows
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
 
-MATCH_URL = "https://crex.com/scoreboard/T3V/1PD/38th-Match/F/G/csk-vs-mi-38th-match-indian-premier-league-2025/live"
 CSS_SELECTOR = "body > app-root > div > app-match-details > div.live-score-header.mob-none > app-match-details-wrapper > div > div > div:nth-child(1) > div.team-content > div.team-score > div"
-CSV_PATH = "live_score_clean.csv"
 
-last_recorded_over = -1.0  # Track the last over recorded
+# Poll fast while the score is moving, back off once it has been still for a while
+LIVE_INTERVAL = 1.0
+IDLE_INTERVAL = 15.0
+IDLE_AFTER = 120.0  # seconds without a change before we treat play as paused
+JITTER = 0.2  # +/- fraction applied to every delay
+
+# Failed fetches back off exponentially; after CIRCUIT_THRESHOLD failures in a
+# row the match's circuit opens and only one probe is sent per CIRCUIT_COOLDOWN
+ERROR_BACKOFF_MAX = 60.0
+CIRCUIT_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 120.0
+
+HEARTBEAT_INTERVAL = 10.0  # the bot's supervisor restarts us if these stop
+LOCK_FILE = "scraper.lock"
+
+# First team-score block inside the live header, i.e. what CSS_SELECTOR points at
+SCORE_PATTERN = re.compile(
+    r'live-score-header.*?class="[^"]*\bteam-score\b[^"]*"[^>]*>\s*<div[^>]*>(.*?)</div>',
+    re.DOTALL,
+)
+TAG_PATTERN = re.compile(r"<[^>]+>")
+
+# Fetch/parse timings; SCRAPER_METRICS_PORT serves them over HTTP
+metrics = Metrics.from_env("SCRAPER_METRICS_PORT")
 
-def init_csv():
-    if not os.path.exists(CSV_PATH):
-        with open(CSV_PATH, "w", newline="") as f:
+def init_csv(path):
+    if not os.path.exists(path):
+        with open(path, "w", newline="") as f:
             writer = csv.writer(f)
-            writer.writerow(["score", "overs"])
+            writer.writerow(["score", "overs", "innings"])
 
-def fetch_score() -> str:
-    r = requests.get(MATCH_URL, headers={"User-Agent": "Mozilla/5.0"})
-    r.raise_for_status()
-    soup = BeautifulSoup(r.text, "html.parser")
+def last_recorded(path):
+    """The stream's last row as a ScoreEvent, so a restart doesn't write it again"""
+    last = None
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            event = parse_score(" ".join(row[:2])) if len(row) >= 2 else None
+            if event is not None:
+                if len(row) > 2 and row[2].isdigit():
+                    event.innings = int(row[2])
+                elif last is not None:
+                    # Older streams have no innings column
+                    event.innings = next_innings(last.innings, last.balls, event.balls)
+                last = event
+    return last
+
+def extract_score(html: str) -> str:
+    """Pull the score text out of a scoreboard page"""
+    # Fast path: targeted regex instead of building a whole DOM
+    match = SCORE_PATTERN.search(html)
+    if match:
+        text = TAG_PATTERN.sub("", match.group(1)).strip()
+        if text:
+            return "".join(text.split())
+    soup = BeautifulSoup(html, HTML_PARSER)
     node = soup.select_one(CSS_SELECTOR)
     if not node:
         raise RuntimeError(f"Selector not found: {CSS_SELECTOR}")
     return node.get_text(strip=True)
 
-def format_score(raw: str):
-    if "-" in raw:
-        parts = raw.split("-")
-        if len(parts) == 2:
-            runs = parts[0]
-            right = parts[1]
-            if "." in right:
-                wickets = right[0]
-                overs = right[1:]  # includes dot
-                return [f"{runs}-{wickets}", overs]
-    return [raw, ""]
-
-def main():
-    global last_recorded_over
-    init_csv()
+class ScoreFetcher:
+    """
+    Polls one scoreboard page over a persistent keep-alive session.
+    Sends If-None-Match / If-Modified-Since so an unchanged page costs a 304.
+    """
+
+    def __init__(self, url, session, min_interval=LIVE_INTERVAL, name=None):
+        self.url = url
+        self.name = name or url  # metrics label
+        self.session = session
+        self.min_interval = min_interval  # per-match rate limit
+        self.etag = None
+        self.last_modified = None
+        self.last_score = None
+        self.last_change = time.monotonic()
+
+    async def fetch(self) -> str:
+        headers = {"User-Agent": "Mozilla/5.0"}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+
+        started = time.perf_counter()
+        async with self.session.get(self.url, headers=headers) as r:
+            metrics.inc("scrape_responses_total", match=self.name, status=r.status)
+            if r.status == 304 and self.last_score is not None:
+                metrics.observe("scrape_fetch_seconds", time.perf_counter() - started, match=self.name)
+                return self.last_score
+            r.raise_for_status()
+            etag = r.headers.get("ETag")
+            last_modified = r.headers.get("Last-Modified")
+            html = await r.text()
+        metrics.observe("scrape_fetch_seconds", time.perf_counter() - started, match=self.name)
+
+        with metrics.timer("scrape_parse_seconds", match=self.name):
+            score = extract_score(html)
+        # Only revalidate against a page we could read: a 304 for one that
+        # failed to parse would otherwise keep serving the previous score
+        self.etag = etag
+        self.last_modified = last_modified
+        if score != self.last_score:
+            self.last_score = score
+            self.last_change = time.monotonic()
+        return score
+
+    def next_delay(self) -> float:
+        """Jittered delay: LIVE_INTERVAL during play, IDLE_INTERVAL between innings"""
+        idle = time.monotonic() - self.last_change > IDLE_AFTER
+        base = IDLE_INTERVAL if idle else LIVE_INTERVAL
+        return max(self.min_interval, base * random.uniform(1 - JITTER, 1 + JITTER))
+
+class MatchPoller:
+    """
+    Scrapes one match. Every ball is kept in an in-memory BallLog; completed
+    overs are appended to the match's score stream for the bot.
+    """
+
+    def __init__(self, match, session):
+        self.match_id = match["match_id"]
+        self.csv_path = match["csv"]
+        self.fetcher = ScoreFetcher(match["url"], session, match["min_interval"], self.match_id)
+        self.balls = BallLog()  # recent balls, one per (innings, ball)
+        self.failures = 0  # consecutive failed polls
+        self.last_ok = None  # epoch seconds of the last successful poll
+        self.unparsed = None  # last page text that held no score
+        init_csv(self.csv_path)
+        last = last_recorded(self.csv_path)
+        if last is not None:
+            self.balls.add(last)
+
+    @property
+    def circuit_open(self):
+        return self.failures >= CIRCUIT_THRESHOLD
+
+    def error_delay(self):
+        if self.circuit_open:
+            return CIRCUIT_COOLDOWN
+        return min(ERROR_BACKOFF_MAX, LIVE_INTERVAL * 2 ** self.failures) * random.uniform(1 - JITTER, 1 + JITTER)
+
+    def status(self):
+        latest = self.balls.latest
+        return {
+            "failures": self.failures,
+            "circuit_open": self.circuit_open,
+            "last_ok": self.last_ok,
+            "score": latest.row() if latest else None,
+            "run_rate": round(self.balls.run_rate(), 2),
+        }
+
+    def record(self, raw):
+        event = parse_score(raw)
+        if event is None:
+            if raw != self.unparsed:
+                self.unparsed = raw
+                print(f"[{self.match_id}] No score in page text: {raw!r}")
+            return
+        if not self.balls.add(event):
+            return  # same ball as the last poll
+        if event.end_of_over:
+            row = event.row()
+            with open(self.csv_path, "a", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(row)
+            notify(self.match_id)  # wake the bot's score feed
+            print(f"[{self.match_id}] Saved: {row[0]}, {row[1]} (innings {row[2]})")
+
+    async def run(self):
+        while True:
+            try:
+                raw_score = await self.fetcher.fetch()
+                self.record(raw_score)
+            except Exception as e:
+                self.failures += 1
+                metrics.inc("scrape_errors_total", match=self.match_id)
+                print(f"[{self.match_id}] Error scraping:", e)
+                if self.failures == CIRCUIT_THRESHOLD:
+                    print(f"[{self.match_id}] {self.failures} failures in a row; "
+                          f"retrying every {CIRCUIT_COOLDOWN:.0f}s until it recovers")
+                await asyncio.sleep(self.error_delay())
+                continue
+
+            if self.circuit_open:
+                print(f"[{self.match_id}] Recovered after {self.failures} failures")
+            self.failures = 0
+            self.last_ok = time.time()
+            await asyncio.sleep(self.fetcher.next_delay())
+
+async def heartbeat(pollers):
+    """Tell the supervising bot we are alive, with each match's health"""
     while True:
-        try:
-            raw_score = fetch_score()
-            formatted = format_score(raw_score)
-
-            overs = formatted[1]
-            if overs:
-                over_float = float(overs)
-                if over_float.is_integer() and over_float > last_recorded_over:
-                    last_recorded_over = over_float
-                    with open(CSV_PATH, "a", newline="") as f:
-                        writer = csv.writer(f)
-                        writer.writerow(formatted)
-                    print(f"Saved: {formatted[0]}, {formatted[1]}")
-                else:
-                    print(f"Skipped (not full over): {formatted[0]}, {formatted[1]}")
-            else:
-                print("Overs data not found in score.")
-
-        except Exception as e:
-            print("Error scraping:", e)
-
-        time.sleep(1)
+        status = {poller.match_id: poller.status() for poller in pollers}
+        print(HEARTBEAT_PREFIX + json.dumps(status), flush=True)
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+def acquire_lock(path=LOCK_FILE):
+    """Hold an exclusive lock for our lifetime, or return None if another scraper has it"""
+    handle = open(path, "w")
+    if fcntl is None:
+        return handle
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+async def main(matches=None):
+    """Poll every followed match concurrently from one event loop"""
+    matches = matches or load_matches()
+    if metrics.port:
+        await metrics.serve(metrics.port)
+    timeout = aiohttp.ClientTimeout(total=10)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        pollers = [MatchPoller(match, session) for match in matches]
+        await asyncio.gather(heartbeat(pollers), *(poller.run() for poller in pollers))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    matches = load_matches()
+    if len(sys.argv) > 1:
+        # Point the first match at another URL, e.g. a local server replaying recorded pages
+        matches[0]["url"] = sys.argv[1]
+    # One scraper per working directory: two would append every row twice
+    lock = acquire_lock()
+    if lock is None:
+        print("Another scraper is already running")
+        sys.exit(EXIT_ALREADY_RUNNING)
+    asyncio.run(main(matches))
@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+
+class AnchorUpdater:
+    """
+    Keeps one anchored message per market showing its latest state.
+    touch() marks a market changed; edits are coalesced so each market's
+    message is edited at most once every `interval` seconds, always with
+    whatever the state is when the edit actually goes out.
+    """
+
+    def __init__(self, render, edit, interval=3.0):
+        self.render = render  # async (question_id) -> embed payload or None
+        self.edit = edit  # async (channel_id, message_id, payload) -> None
+        self.interval = interval
+        self.anchors = {}  # question_id -> (channel_id, message_id)
+        self._last_edit = {}  # question_id -> monotonic time of last edit
+        self._timers = {}  # question_id -> pending flush task
+
+    def track(self, question_id, channel_id, message_id):
+        self.anchors[question_id] = (channel_id, message_id)
+        self._last_edit[question_id] = time.monotonic()  # it was just sent
+
+    def anchored_in(self, question_id, channel_id):
+        anchor = self.anchors.get(question_id)
+        return anchor is not None and anchor[0] == channel_id
+
+    def touch(self, question_id):
+        """Schedule an edit for a changed market; cheap to call on every trade"""
+        if question_id not in self.anchors or question_id in self._timers:
+            return  # not anchored, or an edit is already pending
+        due = self._last_edit.get(question_id, 0) + self.interval
+        delay = max(0.0, due - time.monotonic())
+        self._timers[question_id] = asyncio.create_task(self._flush_later(question_id, delay))
+
+    async def stop(self):
+        for task in list(self._timers.values()):
+            task.cancel()
+        self._timers.clear()
+
+    async def _flush_later(self, question_id, delay):
+        await asyncio.sleep(delay)
+        # Clear the timer first so changes made during the edit queue another one
+        self._timers.pop(question_id, None)
+        anchor = self.anchors.get(question_id)
+        if anchor is None:
+            return
+        self._last_edit[question_id] = time.monotonic()
+        try:
+            payload = await self.render(question_id)
+            if payload is not None:
+                await self.edit(anchor[0], anchor[1], payload)
+        except Exception as e:
+            print(f"Error updating market message for {question_id}: {str(e)}")
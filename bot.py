@@ -1,24 +1,87 @@
 import discord
 from discord.ext import commands
+from discord import app_commands
 import aiosqlite
-import math
 import json
 import asyncio
 from datetime import datetime, timedelta
 import os
 from discord.ext import tasks
-import pandas as pd
 import random
-import subprocess
 import logging
+from database import Database
+from trades import TradeQueue, TradeError
+from engine import MarketEngine
+from pricing import pricing_for, LMSR_PAYOUT, DEFAULT_LIQUIDITY
+from score_feed import ScoreFeed
+from matches import load_matches
+from expiry import ExpiryScheduler
+from view_cache import ViewCache
+from anchors import AnchorUpdater
+from role_sync import RoleSync
+from dispatcher import Dispatcher, PRIORITY_TRADE, PRIORITY_ANNOUNCE
+from guilds import GuildRegistry
+import ledger
+from ledger import OPENING_BALANCE, LedgerSnapshots
+from price_history import PriceHistory, render_chart, sparkline
+from leaderboard import Leaderboard
+from metrics import Metrics, LoopLagMonitor, RateLimitLog
+from offload import Offloader, BlockingWatchdog
+from supervisor import ScraperSupervisor
+import io
+import math
+import time
+from typing import Optional
+
+# Latency histograms and counters; METRICS_PORT serves them over HTTP, METRICS=1 for !stats only
+metrics = Metrics.from_env()
+
+# Shared connections to market.db, opened in main()
+database = Database('market.db', metrics=metrics)
+
+# Blocking or CPU-heavy calls (file reads, charts, JSON) run here, off the event loop
+offloader = Offloader(metrics=metrics)
+
+# Logs the stack of any step that holds the loop longer than LOOP_BLOCK_MS
+watchdog = BlockingWatchdog(threshold=int(os.getenv("LOOP_BLOCK_MS", "250")) / 1000, metrics=metrics)
+
+# Per-guild configuration and background workers
+guilds = GuildRegistry(database)
+
+
+# Shards are started automatically once the bot is in enough guilds
+class MarketBot(commands.AutoShardedBot):
+    async def setup_hook(self):
+        # Runs after login, so overdue markets can be announced right away
+        expiry_scheduler.start()
+        # Register the slash versions of the hybrid commands
+        try:
+            synced = await self.tree.sync()
+            print(f"Synced {len(synced)} slash commands")
+        except discord.HTTPException as e:
+            print(f"Error syncing slash commands: {str(e)}")
+
+    async def close(self):
+        await super().close()
+        await stop_services()
 
-# Start api.py as a background process
-subprocess.Popen(['python3', 'API.py'])
 
 # Bot setup
+# MESSAGE_CONTENT_INTENT=0 drops the privileged message content intent: messages
+# still arrive, only without their text, so prefix commands work just when the
+# bot is mentioned. SLASH_ONLY=1 also turns off message events, which is what
+# stops the gateway delivering every message; only slash commands work then.
+SLASH_ONLY = os.getenv("SLASH_ONLY", "0") == "1"
+MESSAGE_CONTENT = not SLASH_ONLY and os.getenv("MESSAGE_CONTENT_INTENT", "1") != "0"
 intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+intents.message_content = MESSAGE_CONTENT
+if SLASH_ONLY:
+    intents.guild_messages = False
+    intents.dm_messages = False
+bot = MarketBot(
+    command_prefix=commands.when_mentioned_or('!') if MESSAGE_CONTENT else commands.when_mentioned,
+    intents=intents
+)
 
 # === ROLE CONFIGURATION ===
 ROLE_TIERS = [
@@ -31,231 +94,536 @@ ROLE_TIERS = [
     {"name": "International Master", "color": discord.Color.orange(), "threshold": 150},
     {"name": "Grandmaster", "color": discord.Color.red(), "threshold": 200}
 ]
+
+# === MARKET CONFIGURATION ===
+# Auto-generated markets use the bounded-loss LMSR market maker
+AUTO_MARKET_PRICING = "lmsr"
+AUTO_MARKET_LIQUIDITY = DEFAULT_LIQUIDITY
     
 def has_ad_role(ctx):
-    return any(role.name == "AD" for role in ctx.author.roles)
+    # Each guild names its own admin role (default 'AD'), see !configure
+    if ctx.guild is None:
+        return False
+    admin_role = guilds.get(ctx.guild.id).admin_role
+    return any(role.name == admin_role for role in ctx.author.roles)
 
-# Track last processed row globally
-last_processed_index = -1  
 
-@tasks.loop(seconds=10)
-async def automatic_create_question(bot, channel_id):
-    global last_processed_over  # Track overs instead of index
-    filename = 'live_score_clean.csv'
+def admin_only_message(ctx):
+    return (
+        "⛔ You don't have permission to use this command. "
+        f"Only users with the '{guilds.get(ctx.guild.id).admin_role}' role can use it."
+    )
+
+
+@bot.check
+def guild_only(ctx):
+    # Balances and markets belong to a guild, so nothing runs in DMs
+    if ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    return True
+
+# Followed matches and the channels that get auto-generated markets for each
+MATCHES = {match["match_id"]: match for match in load_matches()}
+
+# New rows of every match's score stream, pushed by API.py
+score_feed = ScoreFeed(
+    {match_id: match["csv"] for match_id, match in MATCHES.items()},
+    offload=offloader.run
+)
+
+# API.py as a supervised child process: restarted when it dies or goes quiet
+scraper = ScraperSupervisor()
+
+@tasks.loop(seconds=0)
+async def automatic_create_question(bot):
+    # Wait for the scraper to append the next row of any match
+    event = await score_feed.get()
+    match_id = event['match_id']
     
     try:
-        if os.path.exists(filename):
-            df = pd.read_csv(filename)
-            
-            if df.empty:
-                return
-            
-            latest_row = df.iloc[-1]
-            current_over = latest_row['overs']
-            current_score = int(latest_row['score'].split('-')[0]) 
-
-            # Get latest over value
-            current_over = df['overs'].iloc[-1]
-            
-            # First run initialization
-            if last_processed_over is None:
-                last_processed_over = current_over
-                return
+        current_over = event['overs']
+        current_score = int(event['score'].split('-')[0]) 
+        # Overs restart with the second innings, so compare (innings, over)
+        position = (event.get('innings', 1), current_over)
+        last_processed_over = last_processed_overs.get(match_id)
+        
+        # First run initialization
+        if last_processed_over is None:
+            last_processed_overs[match_id] = position
+            return
 
-            # Check for new over
-            if current_over > last_processed_over:
-                # Get previous score
-                prev_row = df[df['overs'] == last_processed_over].iloc[-1]
-                prev_score = int(prev_row['score'].split('-')[0])
-                
-                # Generate question parameters
-                X = random.randint(6, 14)
-                target_score = current_score + X
-                next_over = current_over + 1  # Question for next over
-                
-                # Create database entry
-                async with aiosqlite.connect('market.db') as db:
-                    end_time = datetime.now() + timedelta(minutes=10)
-                    cursor = await db.execute('''
-                        INSERT INTO questions 
-                        (channel_id, question_text, option1, option2, 
-                         option1_price, option2_price, end_time, auto_generated)
-                        VALUES (?,?,?,?,?,?,?,?)
-                    ''', (
-                        channel_id,
-                        f"Will the team score more than or equal to {target_score} at the end of {next_over:.1f} overs?",
-                        "Yes", "No",
-                        5.0, 5.0,
-                        end_time.isoformat(),
-                        True
-                    ))
-                    question_id = cursor.lastrowid
-                    await db.commit()
-
-                # Send embed message
+        # Check for new over
+        if position > last_processed_over:
+            # Generate question parameters
+            X = random.randint(6, 14)
+            target_score = current_score + X
+            next_over = current_over + 1  # Question for next over
+
+            # One market per channel following this match, opened on each
+            # guild's own worker so one slow guild doesn't delay the rest
+            channel_ids = set(MATCHES[match_id]["channels"]) | set(guilds.market_channels(match_id))
+            for channel_id in channel_ids:
                 channel = bot.get_channel(channel_id)
-                if channel:
-                    embed = discord.Embed(
-                        title=f"📊 Auto-Generated Market (ID: {question_id})",
-                        description=f"Will the team score {target_score} at the end of {next_over:.1f} overs?",
-                        color=0x00ff00
-                    )
-                    embed.add_field(name="1️⃣ Yes", value="Price: 5.00")
-                    embed.add_field(name="2️⃣ No", value="Price: 5.00")
-                    embed.add_field(
-                        name="Market Details",
-                        value=f"X = {X} | Based on score after {current_over} overs: {current_score}",
-                        inline=False
-                    )
-                    await channel.send(embed=embed)
-                
-                # Update tracker
-                last_processed_over = current_over
+                if channel is None or channel.guild is None:
+                    continue
+                guilds.submit(channel.guild.id, lambda channel=channel: open_auto_market(
+                    channel, match_id, X, target_score, next_over,
+                    current_over, current_score, event.get("received"), position[0]
+                ))
+            
+            # Update tracker
+            last_processed_overs[match_id] = position
 
     except Exception as e:
-        print(f"Error in auto-question: {str(e)}", exc_info=True)  # Add exc_info for traceback
+        print(f"Error in auto-question for {match_id}: {str(e)}")
+
+# Initialize the tracker (last (innings, over) seen per match)
+last_processed_overs = {}
+
+
+async def open_auto_market(channel, match_id, X, target_score, next_over, current_over, current_score,
+                           received=None, innings=1):
+    guild_id = channel.guild.id
+    # A guild can follow several matches, so every question names its match and innings
+    match_name = MATCHES.get(match_id, {}).get("name", match_id)
+    innings_name = "1st innings" if innings == 1 else "2nd innings" if innings == 2 else f"innings {innings}"
+    # Create database entry
+    async with database.writer() as db:
+        end_time = datetime.now() + timedelta(minutes=10)
+        cursor = await db.execute('''
+            INSERT INTO questions 
+            (guild_id, channel_id, question_text, option1, option2, 
+             option1_price, option2_price, end_time, auto_generated,
+             pricing, liquidity, match_id)
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+        ''', (
+            guild_id,
+            channel.id,
+            f"{match_name} ({innings_name}): Will the batting team score more than or equal to "
+            f"{target_score} at the end of {next_over:.1f} overs?",
+            "Yes", "No",
+            5.0, 5.0,
+            to_epoch_ms(end_time),
+            True,
+            AUTO_MARKET_PRICING, AUTO_MARKET_LIQUIDITY,
+            match_id
+        ))
+        question_id = cursor.lastrowid
+        await db.commit()
+    market_engine.add(question_id, (5.0, 5.0), AUTO_MARKET_PRICING, AUTO_MARKET_LIQUIDITY, guild_id)
+    price_history.record(question_id, (5.0, 5.0))
+    expiry_scheduler.schedule(question_id, end_time.timestamp())
+    invalidate_market_views(guild_id, question_id)
+
+    # Post the market's anchored message; trades edit it in place.
+    # The guild's worker moves on to the next over while it waits in the outbound queue
+    view = await market_view(question_id)
+    posted = dispatcher.send(
+        channel,
+        f"📊 **Auto-Generated Market (ID: {question_id})** · {match_name}\n"
+        f"X = {X} | Based on score after {current_over} overs: {current_score}",
+        embed=discord.Embed.from_dict(view["embed"]),
+        priority=PRIORITY_ANNOUNCE
+    )
+    task = asyncio.create_task(anchor_when_posted(question_id, channel.id, posted, received))
+    posting_markets.add(task)
+    task.add_done_callback(posting_markets.discard)
+
 
-# Initialize the tracker
-last_processed_over = None
+async def anchor_when_posted(question_id, channel_id, posted, received=None):
+    message = await posted
+    if message:
+        await anchor_market(question_id, channel_id, message.id)
+    if received is not None:
+        # From the score row reaching the bot to the market being posted
+        metrics.observe("score_to_market_seconds", time.time() - received)
+
+# Auto markets whose message has not gone out yet
+posting_markets = set()
 
 
 # Start when bot is ready
 @bot.event
 async def on_ready():
     print(f'Logged in as {bot.user}')
-    automatic_create_question.start(bot, 1363549168022585637)  # Set your channel ID
+    # Channels come from matches.py plus each guild's !configure channel and matches
+    if not automatic_create_question.is_running():
+        automatic_create_question.start(bot)
 
 async def init_db():
-    async with aiosqlite.connect('market.db') as db:
-        # Create users table
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                balance REAL DEFAULT 20.0,
-                shares TEXT,
-                correct_predictions INTEGER DEFAULT 0
-            )
-        ''')
+    # Autocommit, so run_migrations decides where each transaction starts and ends
+    async with aiosqlite.connect('market.db', isolation_level=None) as db:
+        await run_migrations(db)
+
+
+# === SCHEMA MIGRATIONS ===
+# Applied in order; PRAGMA user_version records how many have run.
+# Databases created before versioning are at 0, so every step is idempotent.
+async def migration_base_tables(db):
+    # Create users table
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            balance REAL DEFAULT 20.0,
+            shares TEXT,
+            correct_predictions INTEGER DEFAULT 0
+        )
+    ''')
+
+    # Create questions table with all required columns
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS questions (
+            question_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel_id INTEGER,
+            question_text TEXT,
+            option1 TEXT,
+            option2 TEXT,
+            option1_price REAL DEFAULT 5.0,
+            option2_price REAL DEFAULT 5.0,
+            end_time DATETIME,
+            resolved BOOLEAN DEFAULT FALSE,
+            correct_option INTEGER,
+            auto_generated BOOLEAN DEFAULT FALSE,
+            target_over REAL
+        )
+    ''')
+
+
+async def migration_holdings(db):
+    # One row per (user, market, option) position
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS holdings (
+            user_id INTEGER NOT NULL,
+            question_id INTEGER NOT NULL,
+            option INTEGER NOT NULL,
+            qty REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, question_id, option)
+        )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_holdings_market ON holdings (question_id, option)"
+    )
+    await migrate_share_blobs(db)
 
-        # Create questions table with all required columns
-        await db.execute('''
-            CREATE TABLE IF NOT EXISTS questions (
-                question_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                channel_id INTEGER,
-                question_text TEXT,
-                option1 TEXT,
-                option2 TEXT,
-                option1_price REAL DEFAULT 5.0,
-                option2_price REAL DEFAULT 5.0,
-                end_time DATETIME,
-                resolved BOOLEAN DEFAULT FALSE,
-                correct_option INTEGER,
-                auto_generated BOOLEAN DEFAULT FALSE,
-                target_over REAL
-            )
-        ''')
-        await db.commit()
+
+async def migration_user_stats(db):
+    # Per-user prediction counters, updated when a market is settled
+    cursor = await db.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_stats'"
+    )
+    stats_exist = await cursor.fetchone()
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS user_stats (
+            user_id INTEGER PRIMARY KEY,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            attempted INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    if not stats_exist:
+        await backfill_user_stats(db)
 
 
-        
-# === RANK CHECK COMMAND ===
-# Update this in your checkrank command
-async def checkrank(ctx):
-    async with aiosqlite.connect('market.db') as db:
-        # CALCULATE correct count the same way balance does
-        # by checking resolved questions against user holdings
+async def migration_question_columns(db):
+    # Pricing model per question ('exp' or 'lmsr') and LMSR liquidity b
+    await add_column_if_missing(db, "questions", "pricing", "TEXT DEFAULT 'exp'")
+    await add_column_if_missing(db, "questions", "liquidity", "REAL")
+    # Which followed match an auto-generated market belongs to
+    await add_column_if_missing(db, "questions", "match_id", "TEXT")
+
+
+async def migration_epoch_end_time(db):
+    # end_time moves from ISO text (local time) to integer epoch milliseconds
+    cursor = await db.execute(
+        "SELECT question_id, end_time FROM questions WHERE typeof(end_time) = 'text'"
+    )
+    rows = await cursor.fetchall()
+    await db.executemany(
+        "UPDATE questions SET end_time = ? WHERE question_id = ?",
+        [(to_epoch_ms(datetime.fromisoformat(end_time)), qid) for qid, end_time in rows]
+    )
+    # Open-market listing and expiry only ever look at unresolved rows
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_questions_open_end ON questions (end_time) WHERE resolved = FALSE"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_questions_settled ON questions (resolved, correct_option)"
+    )
+
+
+async def migration_anchor_message(db):
+    # The message each market keeps edited with its live prices
+    await add_column_if_missing(db, "questions", "message_id", "INTEGER")
+
+
+async def migration_guild_scope(db):
+    # Balances, stats and markets become per guild. Rows from the
+    # single-guild era are assigned to LEGACY_GUILD_ID.
+    legacy_guild_id = int(os.getenv("LEGACY_GUILD_ID", "0"))
+    if not legacy_guild_id:
         cursor = await db.execute(
-            "SELECT question_id, correct_option FROM questions WHERE resolved = TRUE"
+            "SELECT EXISTS (SELECT 1 FROM users) OR EXISTS (SELECT 1 FROM questions)"
         )
-        resolved_questions = await cursor.fetchall()
-        
-        user = await (await db.execute(
-            "SELECT * FROM users WHERE user_id = ?",
-            (ctx.author.id,)
-        )).fetchone()
-        
-        # Use the SAME calculation as in balance
-        correct_count = 0
-        if user and user[2]:  # if user exists and has shares
-            shares = json.loads(user[2])
-            for qid, correct_option in resolved_questions:
-                qid_str = str(qid)
-                if qid_str in shares:
-                    user_options = shares[qid_str]
-                    for opt in user_options:
-                        if int(opt) == correct_option:
-                            correct_count += 1
-
-# === IMPROVED ROLE UPDATE FUNCTION ===
-async def update_user_role(guild, user_id):
-    """Update a user's role based on their prediction success"""
-    try:
-        # Refresh role data
-        await guild.fetch_roles()
-        
-        # Get user data
-        async with aiosqlite.connect('market.db') as db:
-            cursor = await db.execute(
-                "SELECT COALESCE(correct_predictions, 0) FROM users WHERE user_id = ?", 
-                (user_id,)
+        if (await cursor.fetchone())[0]:
+            # Guessing would hand every balance and market to a guild nobody is in, for good
+            raise RuntimeError(
+                "market.db holds balances or markets from before guild support. "
+                "Set LEGACY_GUILD_ID to the ID of the server they belong to and restart."
             )
-            result = await cursor.fetchone()
-            correct_count = result[0] if result else 0
 
-        # Find appropriate tier
-        current_tier = next((t for t in reversed(ROLE_TIERS) if correct_count >= t["threshold"]), None)
-        if not current_tier:
-            return
+    await add_column_if_missing(db, "questions", "guild_id", "INTEGER")
+    await db.execute("UPDATE questions SET guild_id = ? WHERE guild_id IS NULL", (legacy_guild_id,))
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_questions_guild_open ON questions (guild_id, end_time) WHERE resolved = FALSE"
+    )
 
-        member = guild.get_member(user_id)
-        if not member:
-            return
+    # SQLite can't change a primary key in place, so rebuild both tables
+    await db.execute('''
+        CREATE TABLE users_scoped (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            balance REAL DEFAULT 20.0,
+            shares TEXT,
+            correct_predictions INTEGER DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    await db.execute('''
+        INSERT INTO users_scoped (guild_id, user_id, balance, shares, correct_predictions)
+        SELECT ?, user_id, balance, shares, correct_predictions FROM users
+    ''', (legacy_guild_id,))
+    await db.execute("DROP TABLE users")
+    await db.execute("ALTER TABLE users_scoped RENAME TO users")
+
+    await db.execute('''
+        CREATE TABLE user_stats_scoped (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            correct INTEGER NOT NULL DEFAULT 0,
+            wrong INTEGER NOT NULL DEFAULT 0,
+            attempted INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    await db.execute('''
+        INSERT INTO user_stats_scoped (guild_id, user_id, correct, wrong, attempted)
+        SELECT ?, user_id, correct, wrong, attempted FROM user_stats
+    ''', (legacy_guild_id,))
+    await db.execute("DROP TABLE user_stats")
+    await db.execute("ALTER TABLE user_stats_scoped RENAME TO user_stats")
+
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS guild_config (
+            guild_id INTEGER PRIMARY KEY,
+            market_channel_id INTEGER,
+            admin_role TEXT DEFAULT 'AD'
+        )
+    ''')
+
+
+async def migration_ledger(db):
+    # Append-only record of every balance change; users.balance is its running total
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            amount REAL NOT NULL,
+            question_id INTEGER,
+            created_at INTEGER NOT NULL
+        )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (guild_id, user_id)"
+    )
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ledger_question ON ledger (question_id) WHERE question_id IS NOT NULL"
+    )
+    # Balances as of entry snapshot_entry_id; reconciliation replays only what follows
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS balance_snapshots (
+            guild_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            PRIMARY KEY (guild_id, user_id)
+        )
+    ''')
+    await db.execute(
+        "CREATE TABLE IF NOT EXISTS ledger_meta (snapshot_entry_id INTEGER NOT NULL)"
+    )
+    await db.execute("INSERT INTO ledger_meta (snapshot_entry_id) VALUES (0)")
+    # Balances from before the ledger become each account's opening entry
+    await db.execute('''
+        INSERT INTO ledger (guild_id, user_id, kind, amount, created_at)
+        SELECT guild_id, user_id, 'opening', COALESCE(balance, 0), ? FROM users
+    ''', (ledger.now_ms(),))
+
+
+async def migration_price_ticks(db):
+    # Append-only price path of every market, one row per fill
+    await db.execute('''
+        CREATE TABLE IF NOT EXISTS price_ticks (
+            question_id INTEGER NOT NULL,
+            ts INTEGER NOT NULL,
+            price1 REAL NOT NULL,
+            price2 REAL NOT NULL
+        )
+    ''')
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_price_ticks_market ON price_ticks (question_id, ts)"
+    )
 
-        # Get or create role with proper hierarchy
-        role = discord.utils.get(guild.roles, name=current_tier["name"])
-        if not role:
-            try:
-                bot_top_role = guild.me.top_role
-                role = await guild.create_role(
-                    name=current_tier["name"],
-                    color=current_tier["color"],
-                    reason="Auto-created prediction tier role",
-                    position=bot_top_role.position - 1
-                )
-            except discord.Forbidden:
-                print(f"Missing permissions to create role: {current_tier['name']}")
-                return
 
-        # Check role position
-        if role.position >= guild.me.top_role.position:
-            print(f"Bot cannot assign higher role: {role.name}")
-            return
+async def migration_guild_matches(db):
+    # Which matches a guild follows; NULL keeps the old behaviour of following all of them
+    await add_column_if_missing(db, "guild_config", "matches", "TEXT")
+
+
+MIGRATIONS = [
+    migration_base_tables,
+    migration_holdings,
+    migration_user_stats,
+    migration_question_columns,
+    migration_epoch_end_time,
+    migration_anchor_message,
+    migration_guild_scope,
+    migration_ledger,
+    migration_price_ticks,
+    migration_guild_matches,
+]
+
+
+async def run_migrations(db):
+    """
+    Bring the schema up to len(MIGRATIONS), one transaction per step.
+    A step and its user_version bump commit together or not at all, so a
+    failed step leaves the database at the previous version to retry.
+    """
+    cursor = await db.execute("PRAGMA user_version")
+    version = (await cursor.fetchone())[0]
+    for number, step in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        # Explicit, because sqlite3 doesn't open a transaction before DDL on its own
+        await db.execute("BEGIN")
+        try:
+            await step(db)
+            await db.execute(f"PRAGMA user_version = {number}")
+            await db.execute("COMMIT")
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+        print(f"Applied migration {number}: {step.__name__}")
+
+
+def to_epoch_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def from_epoch_ms(ms):
+    return datetime.fromtimestamp(ms / 1000)
+
+
+async def add_column_if_missing(db, table, column, declaration):
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in await cursor.fetchall()]:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+
+STATS_UPSERT = '''
+    INSERT INTO user_stats (guild_id, user_id, correct, wrong, attempted)
+    SELECT q.guild_id, h.user_id,
+           SUM(h.option = q.correct_option),
+           SUM(h.option != q.correct_option),
+           COUNT(*)
+    FROM holdings h
+    JOIN questions q ON q.question_id = h.question_id
+    WHERE {where} AND h.qty > 0
+    GROUP BY q.guild_id, h.user_id
+    ON CONFLICT (guild_id, user_id) DO UPDATE SET
+        correct = correct + excluded.correct,
+        wrong = wrong + excluded.wrong,
+        attempted = attempted + excluded.attempted
+'''
+
+
+async def backfill_user_stats(db):
+    """Seed user_stats from every market settled before the table existed"""
+    # Runs at migration 3, before stats were scoped by guild
+    await db.execute('''
+        INSERT INTO user_stats (user_id, correct, wrong, attempted)
+        SELECT h.user_id,
+               SUM(h.option = q.correct_option),
+               SUM(h.option != q.correct_option),
+               COUNT(*)
+        FROM holdings h
+        JOIN questions q ON q.question_id = h.question_id
+        WHERE q.correct_option IS NOT NULL AND h.qty > 0
+        GROUP BY h.user_id
+    ''')
+
+
+async def migrate_share_blobs(db):
+    """Move legacy users.shares JSON blobs into the holdings table (one-shot)"""
+    cursor = await db.execute(
+        "SELECT user_id, shares FROM users WHERE shares IS NOT NULL AND shares != ''"
+    )
+    rows = await cursor.fetchall()
+    if not rows:
+        return
+
+    positions = await offloader.run(share_blob_positions, rows)
+    await db.executemany('''
+        INSERT INTO holdings (user_id, question_id, option, qty)
+        VALUES (?,?,?,?)
+        ON CONFLICT (user_id, question_id, option) DO UPDATE SET qty = qty + excluded.qty
+    ''', positions)
+    # Clear the blobs so the migration never runs twice
+    await db.execute("UPDATE users SET shares = NULL WHERE shares IS NOT NULL")
+    print(f"Migrated {len(positions)} holdings from {len(rows)} users")
+
+
+def share_blob_positions(rows):
+    """(user_id, shares JSON) rows -> holdings rows; CPU-bound, runs on the offloader"""
+    positions = []
+    for user_id, blob in rows:
+        try:
+            shares = json.loads(blob)
+        except ValueError:
+            print(f"Skipping unreadable shares for user {user_id}")
+            continue
+        for qid, opts in shares.items():
+            for opt, qty in opts.items():
+                if qty > 0:
+                    positions.append((user_id, int(qid), int(opt), qty))
+    return positions
+
+
+# === ROLE SYNC ===
+# Tier roles are cached per guild; only members whose tier changed are touched
+role_sync = RoleSync(ROLE_TIERS)
+
+
+@bot.event
+async def on_guild_role_delete(role):
+    if role.name in role_sync.tier_names:
+        role_sync.forget(role.guild.id)
+
 
-        # Remove old tier roles
-        current_roles = [r for r in member.roles if r.name in [t["name"] for t in ROLE_TIERS]]
-        if current_roles:
-            await member.remove_roles(*current_roles, reason="Rank update")
-            
-        # Add new role
-        await member.add_roles(role, reason="Rank update")
-        
-    except Exception as e:
-        print(f"Error updating roles: {str(e)}")
-        
-        
 @bot.command()
-@commands.check(has_ad_role)  # Only users with 'AD' role can use this
+@commands.check(has_ad_role)  # Only the guild's admin role can use this
 async def test_role(ctx, member: discord.Member):
     """Test role assignment (Admin only)"""
     try:
         role = discord.utils.get(ctx.guild.roles, name="Newbie")
         if not role:
-            await ctx.send("Role 'Newbie' does not exist!")
+            dispatcher.send(ctx, "Role 'Newbie' does not exist!")
             return
         await member.add_roles(role)
-        await ctx.send(f"✅ Assigned {role.name} to {member.mention}")
+        dispatcher.send(ctx, f"✅ Assigned {role.name} to {member.mention}")
     except Exception as e:
-        await ctx.send(f"❌ Error: {str(e)}")
+        dispatcher.send(ctx, f"❌ Error: {str(e)}")
 
 @bot.command()
 async def check_perms(ctx):
@@ -265,60 +633,115 @@ async def check_perms(ctx):
     embed.add_field(name="Manage Roles", value=str(perms.manage_roles))
     embed.add_field(name="Administrator", value=str(perms.administrator))
     embed.add_field(name="Top Role", value=ctx.guild.me.top_role.name)
-    await ctx.send(embed=embed)
+    dispatcher.send(ctx, embed=embed)
+
+
+# === MARKET EXPIRY ===
+async def close_expired_markets(question_ids):
+    """Close every market in one batch the moment its deadline passes"""
+    # Stop trading first so the final prices are checkpointed
+    for qid in question_ids:
+        await market_engine.close(qid)
+        price_history.forget(qid)
+
+    placeholders = ",".join("?" * len(question_ids))
+    async with database.writer() as db:
+        cursor = await db.execute(f'''
+            UPDATE questions SET resolved = TRUE
+            WHERE question_id IN ({placeholders}) AND resolved = FALSE
+            RETURNING question_id, guild_id, channel_id, question_text
+        ''', question_ids)
+        closed = await cursor.fetchall()
+        await db.commit()
+    for qid, guild_id, _, _ in closed:
+        invalidate_market_views(guild_id, qid)
+        anchors.touch(qid)
 
+    # Announce without holding up the next deadline
+    if closed:
+        task = asyncio.create_task(announce_closed_markets(closed))
+        closing_announcements.add(task)
+        task.add_done_callback(closing_announcements.discard)
 
-# Background task
-async def check_active_questions():
+
+async def announce_closed_markets(closed):
     await bot.wait_until_ready()
-    while not bot.is_closed():
-        async with aiosqlite.connect('market.db') as db:
-            now = datetime.now().isoformat()
-            async with db.execute(
-                "SELECT question_id, channel_id, question_text FROM questions WHERE end_time < ? AND resolved = FALSE",
-                (now,)
-            ) as cursor:
-                expired = await cursor.fetchall()
-            for qid, channel_id, question_text in expired:
-                await db.execute(
-                    "UPDATE questions SET resolved = TRUE WHERE question_id = ?",
-                    (qid,)
-                )
-                channel = bot.get_channel(channel_id)
-                if channel:
-                    await channel.send(
-                        f"⏰ **Prediction Closed!**\n> {question_text}\nNo more bets are accepted."
-                    )
-            await db.commit()
-        await asyncio.sleep(60)
+    for _, _, channel_id, question_text in closed:
+        channel = bot.get_channel(channel_id)
+        if channel:
+            dispatcher.send(
+                channel,
+                f"⏰ **Prediction Closed!**\n> {question_text}\nNo more bets are accepted.",
+                priority=PRIORITY_ANNOUNCE
+            )
+
+# Closure announcements still waiting for the bot to be ready
+closing_announcements = set()
+
+
+async def schedule_open_markets():
+    """Load the deadline of every open market into the expiry scheduler"""
+    async with database.reader() as db:
+        cursor = await db.execute(
+            "SELECT question_id, end_time FROM questions WHERE resolved = FALSE"
+        )
+        rows = await cursor.fetchall()
+    for qid, end_time in rows:
+        expiry_scheduler.schedule(qid, end_time / 1000)
+
+
+expiry_scheduler = ExpiryScheduler(close_expired_markets)
+
+
+# === ANCHORED MARKET MESSAGES ===
+async def edit_anchor(channel_id, message_id, payload):
+    channel = bot.get_channel(channel_id)
+    if channel:
+        message = channel.get_partial_message(message_id)
+        await dispatcher.call(
+            channel,
+            lambda: message.edit(embed=discord.Embed.from_dict(payload)),
+            priority=PRIORITY_ANNOUNCE
+        )
+
+
+async def anchor_market(question_id, channel_id, message_id):
+    """Remember the message a market keeps up to date"""
+    async with database.writer() as db:
+        await db.execute(
+            "UPDATE questions SET message_id = ? WHERE question_id = ?",
+            (message_id, question_id)
+        )
+        await db.commit()
+    anchors.track(question_id, channel_id, message_id)
+
+
+async def load_anchors():
+    """Re-attach the messages of every market that can still change"""
+    async with database.reader() as db:
+        cursor = await db.execute(
+            "SELECT question_id, channel_id, message_id FROM questions "
+            "WHERE message_id IS NOT NULL AND correct_option IS NULL"
+        )
+        rows = await cursor.fetchall()
+    for qid, channel_id, message_id in rows:
+        anchors.track(qid, channel_id, message_id)
+
+
         
-@bot.command(name="check_rank")
+@bot.hybrid_command(name="check_rank")
 async def check_rank(ctx):
     """Show your prediction rank and update your role if needed."""
+    await ctx.defer()
 
-    async with aiosqlite.connect('market.db') as db:
-        # Get all resolved questions
+    # Count correct predictions (1 per correct question, not per share)
+    async with database.reader() as db:
         cursor = await db.execute(
-            "SELECT question_id, correct_option FROM questions WHERE resolved = TRUE AND correct_option IS NOT NULL"
+            "SELECT correct FROM user_stats WHERE guild_id = ? AND user_id = ?",
+            (ctx.guild.id, ctx.author.id)
         )
-        resolved_questions = await cursor.fetchall()
-
-        # Get user data
-        user = await (await db.execute(
-            "SELECT * FROM users WHERE user_id = ?",
-            (ctx.author.id,)
-        )).fetchone()
-
-    # Calculate correct predictions (1 per correct question, not per share)
-    correct_count = 0
-    if user and user[2]:
-        shares = json.loads(user[2])
-        for qid, correct_option in resolved_questions:
-            qid_str = str(qid)
-            if qid_str in shares:
-                user_options = shares[qid_str]
-                if str(correct_option) in user_options and user_options[str(correct_option)] > 0:
-                    correct_count += 1
+        row = await cursor.fetchone()
+        correct_count = row[0] if row else 0
 
     # Determine rank/tier
     current_tier = None
@@ -329,31 +752,7 @@ async def check_rank(ctx):
     role_name = current_tier["name"] if current_tier else "Newbie"
 
     # --- Role update logic ---
-    member = await ctx.guild.fetch_member(ctx.author.id)  # Always fetch fresh member data
-
-    if member and current_tier:
-        # Get or create the role
-        role = discord.utils.get(ctx.guild.roles, name=current_tier["name"])
-        if not role:
-            # Create the role just below the bot's top role
-            bot_top_role = ctx.guild.me.top_role
-            role = await ctx.guild.create_role(
-                name=current_tier["name"],
-                color=current_tier["color"],
-                reason="Auto-created prediction tier role",
-            )
-            # Move the role just below the bot's top role
-            await role.edit(position=bot_top_role.position - 1)
-
-        # Remove all other prediction roles
-        tier_names = [t["name"] for t in ROLE_TIERS]
-        roles_to_remove = [r for r in member.roles if r.name in tier_names and r != role]
-        if roles_to_remove:
-            await member.remove_roles(*roles_to_remove, reason="Prediction rank update")
-
-        # Add the correct role if not already present
-        if role not in member.roles:
-            await member.add_roles(role, reason="Prediction rank update")
+    await role_sync.sync(ctx.guild, {ctx.author.id: correct_count})
 
     # --- Send result embed ---
     embed = discord.Embed(
@@ -362,108 +761,201 @@ async def check_rank(ctx):
     )
     embed.add_field(name="Correct Predictions", value=str(correct_count))
     embed.add_field(name="Current Rank", value=role_name)
-    await ctx.send(embed=embed)
+    dispatcher.send(ctx, embed=embed)
 
 
-@bot.command()
+async def apply_buy(db, trade):
+    """Execute a buy inside the trade writer's transaction"""
+    user = await (await db.execute(
+        "SELECT balance FROM users WHERE guild_id = ? AND user_id = ?",
+        (trade.guild_id, trade.user_id)
+    )).fetchone()
+    current_balance = user[0] if user else OPENING_BALANCE
+
+    async def settle(price, new_prices):
+        # Cost uses the price before this trade moves it
+        total_cost = trade.shares * price
+        if current_balance < total_cost:
+            raise TradeError("Insufficient funds!")
+
+        # Record the balance change, then update user balance and holdings
+        if not user:
+            await ledger.record(db, trade.guild_id, trade.user_id, "opening", OPENING_BALANCE)
+        await ledger.record(db, trade.guild_id, trade.user_id, "buy", -total_cost, trade.question_id)
+        await db.execute('''
+            INSERT INTO users (guild_id, user_id, balance)
+            VALUES (?,?,?)
+            ON CONFLICT (guild_id, user_id) DO UPDATE SET balance = excluded.balance
+        ''', (trade.guild_id, trade.user_id, current_balance - total_cost))
+
+        await db.execute('''
+            INSERT INTO holdings (user_id, question_id, option, qty)
+            VALUES (?,?,?,?)
+            ON CONFLICT (user_id, question_id, option) DO UPDATE SET qty = qty + excluded.qty
+        ''', (trade.user_id, trade.question_id, trade.option, trade.shares))
+
+    filled = await market_engine.fill(trade.question_id, trade.option, trade.shares, settle)
+    if filled is None:
+        raise TradeError("Invalid or expired question ID!")
+
+    price, new_prices, _ = filled
+    return {"price": price, "new_prices": new_prices}
+
+
+async def apply_sell(db, trade):
+    """Execute a sell inside the trade writer's transaction"""
+    position = await (await db.execute(
+        "SELECT qty FROM holdings WHERE user_id = ? AND question_id = ? AND option = ?",
+        (trade.user_id, trade.question_id, trade.option)
+    )).fetchone()
+
+    if not position:
+        raise TradeError("You don't own any shares in this question!")
+
+    holdings = position[0]
+    if trade.shares > holdings:
+        raise TradeError(f"You only have {holdings} shares to sell!")
+
+    async def settle(price, new_prices):
+        # Record the proceeds, then update user balance and holdings
+        await ledger.record(db, trade.guild_id, trade.user_id, "sell", trade.shares * price, trade.question_id)
+        await db.execute(
+            "UPDATE users SET balance = balance + ? WHERE guild_id = ? AND user_id = ?",
+            (trade.shares * price, trade.guild_id, trade.user_id)
+        )
+
+        # Cleanup empty holdings
+        if holdings - trade.shares <= 0:
+            await db.execute(
+                "DELETE FROM holdings WHERE user_id = ? AND question_id = ? AND option = ?",
+                (trade.user_id, trade.question_id, trade.option)
+            )
+        else:
+            await db.execute(
+                "UPDATE holdings SET qty = qty - ? WHERE user_id = ? AND question_id = ? AND option = ?",
+                (trade.shares, trade.user_id, trade.question_id, trade.option)
+            )
+
+    # Negative quantity for selling
+    filled = await market_engine.fill(trade.question_id, trade.option, -trade.shares, settle)
+    if filled is None:
+        raise TradeError("Invalid or expired question ID!")
+
+    price, new_prices, _ = filled
+    return {"price": price, "new_prices": new_prices}
+
+
+async def apply_trade(db, trade):
+    # NaN compares false with everything, so check finiteness first
+    if not math.isfinite(trade.shares) or trade.shares <= 0:
+        raise TradeError("Share amount must be a positive number!")
+    # Markets can only be traded from the guild that created them
+    market = market_engine.get(trade.question_id)
+    if market is None or market.guild_id != trade.guild_id:
+        raise TradeError("Invalid or expired question ID!")
+    if trade.kind == "buy":
+        return await apply_buy(db, trade)
+    return await apply_sell(db, trade)
+
+
+@bot.hybrid_command()
+@app_commands.describe(question_id="Open market ID", option="Option 1 or 2", shares="Number of shares")
 async def buy(ctx, question_id: int, option: int, shares: float):
     """Buy shares in a prediction market"""
     if option not in [1, 2]:
-        await ctx.send("Invalid option! Use 1 or 2")
+        dispatcher.send(ctx, "Invalid option! Use 1 or 2")
         return
 
-    async with aiosqlite.connect('market.db') as db:
-        async with db.execute("BEGIN TRANSACTION"):
-            # Get question and user data
-            question = await (await db.execute(
-                "SELECT option1_price, option2_price FROM questions WHERE question_id = ? AND resolved = FALSE",
-                (question_id,)
-            )).fetchone()
-            
-            user = await (await db.execute(
-                "SELECT * FROM users WHERE user_id = ?",
-                (ctx.author.id,)
-            )).fetchone()
-
-            if not question:
-                await ctx.send("Invalid or expired question ID!")
-                return
-
-            # Get current prices
-            price1, price2 = question[0], question[1]
-            
-            # Calculate new prices for both options
-            new_price1, new_price2 = update_prices(price1, price2, shares, option)
-            
-            # Calculate cost using the original price before update
-            original_price = price1 if option == 1 else price2
-            total_cost = shares * original_price
-
-            # Check balance
-            current_balance = user[1] if user else 20.0
-            if current_balance < total_cost:
-                await ctx.send("Insufficient funds!")
-                return
-
-            # Update both prices in the database
-            await db.execute('''
-                UPDATE questions 
-                SET option1_price = ?, option2_price = ?
-                WHERE question_id = ?
-            ''', (new_price1, new_price2, question_id))
-
-            # Update user balance and shares
-            new_balance = current_balance - total_cost
-            shares_data = json.loads(user[2]) if user and user[2] else {}
-            shares_data.setdefault(str(question_id), {})[str(option)] = shares_data.get(str(question_id), {}).get(str(option), 0) + shares
-            
-            await db.execute('''
-                INSERT OR REPLACE INTO users 
-                (user_id, balance, shares)
-                VALUES (?,?,?)
-            ''', (ctx.author.id, new_balance, json.dumps(shares_data)))
-            
-            await db.commit()
+    try:
+        # Slash trades are acknowledged at once and answered privately when filled
+        await ctx.defer(ephemeral=True)
+        fill = await trade_queue.submit("buy", ctx.guild.id, ctx.author.id, question_id, option, shares)
+    except TradeError as e:
+        dispatcher.send(ctx, str(e))
+        return
 
-    await ctx.send(
-        f"✅ Bought {shares} shares of Option {option} at {original_price:.2f} each!\n"
-        f"New prices: Option 1 - {new_price1:.2f} | Option 2 - {new_price2:.2f}"
+    # Fills are only returned once committed, so the tick can't outlive a failed batch
+    price_history.record(question_id, fill["new_prices"])
+    anchors.touch(question_id)
+    # Prefix confirmations may be merged into one message, so they name the trader
+    trader = "" if ctx.interaction else f"**{ctx.author.display_name}**: "
+    # The anchored market message already shows the new prices
+    if ctx.interaction is None and anchors.anchored_in(question_id, ctx.channel.id):
+        dispatcher.call(
+            ctx, lambda: ctx.message.add_reaction("✅"), priority=PRIORITY_TRADE,
+            fallback=f"✅ {trader}bought {shares} of Option {option} in #{question_id} at {fill['price']:.2f}"
+        )
+        return
+    new_price1, new_price2 = fill["new_prices"]
+    dispatcher.send(
+        ctx,
+        f"✅ {trader}Bought {shares} shares of Option {option} at {fill['price']:.2f} each!\n"
+        f"New prices: Option 1 - {new_price1:.2f} | Option 2 - {new_price2:.2f}",
+        ephemeral=True,
+        priority=PRIORITY_TRADE
     )
 
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.describe(question_id="Market ID")
 async def market(ctx, question_id: int):
     """View current market status"""
-    async with aiosqlite.connect('market.db') as db:
-        question = await (await db.execute(
-            "SELECT * FROM questions WHERE question_id = ?",
-            (question_id,)
-        )).fetchone()
-
-    if not question:
-        await ctx.send("❌ Invalid question ID!")
+    view = await market_view(question_id)
+    if view is None or view["guild_id"] != ctx.guild.id:
+        dispatcher.send(ctx, "❌ Invalid question ID!")
         return
+    dispatcher.send(ctx, embed=discord.Embed.from_dict(view["embed"]))
+
+
+async def market_view(question_id):
+    """
+    Cached {"guild_id", "embed"} view of a market, or None if it doesn't exist.
+    Open markets re-render when a trade bumps their version.
+    """
+    state = market_engine.get(question_id)
+    version = state.version if state else None
+    return await view_cache.get(
+        ("market", question_id), version, lambda: render_market(question_id)
+    )
 
-    # Extract info for clarity
-    qid = question[0]
-    qtext = question[2]
-    option1 = question[3]
-    option2 = question[4]
-    price1 = question[5]
-    price2 = question[6]
-    end_time = datetime.fromisoformat(question[7])
-    resolved = question[9]
-    correct_option = question[8]
-
-    status = "🟢 **Active**" if not resolved else "🔒 **Closed**"
+
+# Order sizes the market view quotes a total cost for
+QUOTE_SIZES = (1, 10, 50)
+
+
+async def render_market(question_id):
+    """View for !market, or None for an unknown question"""
+    async with database.reader() as db:
+        row = await (await db.execute('''
+            SELECT guild_id, question_id, question_text, option1, option2,
+                   option1_price, option2_price, end_time, resolved, correct_option
+            FROM questions WHERE question_id = ?
+        ''', (question_id,))).fetchone()
+
+    if not row:
+        return None
+    (guild_id, qid, qtext, option1, option2,
+     stored_price1, stored_price2, end_ms, resolved, correct_option) = row
+    # Open markets are priced from the live engine, not the last checkpoint
+    price1, price2 = market_engine.quote(qid) or (stored_price1, stored_price2)
+    end_time = from_epoch_ms(end_ms)
+
+    # resolved is set when trading closes; correct_option once it is settled
+    active = not resolved and end_time > datetime.now()
+    if active:
+        status = "🟢 **Active**"
+    elif correct_option is None:
+        status = "🔒 **Closed** (awaiting result)"
+    else:
+        status = "🔒 **Closed**"
     result = ""
-    if resolved and correct_option:
+    if correct_option is not None:
         result = f"\n\n🏆 **Result:** Option {correct_option} was correct!"
 
     embed = discord.Embed(
         title=f"📊 Prediction Market #{qid}",
         description=f"**{qtext}**\n\nMarket Status: {status}{result}",
-        color=0x00ff00 if not resolved else 0xff5555
+        color=0x00ff00 if active else 0xff5555
     )
     embed.add_field(
         name=f"🟩 Option 1: {option1}",
@@ -475,128 +967,89 @@ async def market(ctx, question_id: int):
         value=f"💸 **Price:** {price2:.2f} coins",
         inline=True
     )
+    state = market_engine.get(qid)
+    if state is not None:
+        embed.add_field(
+            name="📦 Volume",
+            value=f"{state.outstanding[0]:.2f} / {state.outstanding[1]:.2f} shares held",
+            inline=False
+        )
+        # Bigger orders move the price as they fill, so quote whole orders
+        lines = []
+        for option in (1, 2):
+            costs = market_engine.quote_sizes(qid, option, QUOTE_SIZES)
+            quotes = " · ".join(f"{size} for {cost:.2f}" for size, cost in zip(QUOTE_SIZES, costs))
+            lines.append(f"Option {option}: {quotes}")
+        embed.add_field(name="🧮 Cost to Buy", value="\n".join(lines), inline=False)
     embed.add_field(
         name="⏰ Closes At",
         value=end_time.strftime("%Y-%m-%d %H:%M"),
         inline=False
     )
     embed.set_footer(text="Use !buy <question_id> <option_number> <shares> to participate!")
-
-    await ctx.send(embed=embed)
+    return {"guild_id": guild_id, "embed": embed.to_dict()}
 
 
 # Add this command handler
-@bot.command()
+@bot.hybrid_command()
+@app_commands.describe(question_id="Open market ID", option="Option 1 or 2", shares="Number of shares")
 async def sell(ctx, question_id: int, option: int, shares: float):
     """Sell shares in a prediction market"""
     if option not in [1, 2]:
-        await ctx.send("Invalid option! Use 1 or 2")
+        dispatcher.send(ctx, "Invalid option! Use 1 or 2")
         return
 
-    async with aiosqlite.connect('market.db') as db:
-        async with db.execute("BEGIN TRANSACTION"):
-            # Get question and user data
-            question = await (await db.execute(
-                "SELECT * FROM questions WHERE question_id = ? AND resolved = FALSE",
-                (question_id,)
-            )).fetchone()
-            
-            user = await (await db.execute(
-                "SELECT * FROM users WHERE user_id = ?",
-                (ctx.author.id,)
-            )).fetchone()
-
-            if not question:
-                await ctx.send("Invalid or expired question ID!")
-                return
-
-            if not user or not user[2]:
-                await ctx.send("You don't own any shares in this question!")
-                return
-
-            shares_data = json.loads(user[2])
-            holdings = shares_data.get(str(question_id), {}).get(str(option), 0)
-            
-            if shares > holdings:
-                await ctx.send(f"You only have {holdings} shares to sell!")
-                return
-
-            # Calculate proceeds
-            price = question[5 if option == 1 else 6]
-            total_proceeds = shares * price
-
-            # Update price
-            new_price = update_price(price, -shares)  # Negative quantity for selling
-            await db.execute(f'''
-                UPDATE questions 
-                SET option{option}_price = ?
-                WHERE question_id = ?
-            ''', (new_price, question_id))
-
-            # Update user balance and shares
-            new_balance = user[1] + total_proceeds
-            shares_data[str(question_id)][str(option)] -= shares
-            
-            # Cleanup empty holdings
-            if shares_data[str(question_id)][str(option)] <= 0:
-                del shares_data[str(question_id)][str(option)]
-            if not shares_data[str(question_id)]:
-                del shares_data[str(question_id)]
-            
-            await db.execute('''
-                UPDATE users 
-                SET balance = ?, shares = ?
-                WHERE user_id = ?
-            ''', (new_balance, json.dumps(shares_data), ctx.author.id))
-            
-            await db.commit()
+    try:
+        # Slash trades are acknowledged at once and answered privately when filled
+        await ctx.defer(ephemeral=True)
+        fill = await trade_queue.submit("sell", ctx.guild.id, ctx.author.id, question_id, option, shares)
+    except TradeError as e:
+        dispatcher.send(ctx, str(e))
+        return
 
-    await ctx.send(f"✅ Sold {shares} shares of Option {option} at {price:.2f} each!")
+    price_history.record(question_id, fill["new_prices"])
+    anchors.touch(question_id)
+    trader = "" if ctx.interaction else f"**{ctx.author.display_name}**: "
+    if ctx.interaction is None and anchors.anchored_in(question_id, ctx.channel.id):
+        dispatcher.call(
+            ctx, lambda: ctx.message.add_reaction("✅"), priority=PRIORITY_TRADE,
+            fallback=f"✅ {trader}sold {shares} of Option {option} in #{question_id} at {fill['price']:.2f}"
+        )
+        return
+    dispatcher.send(ctx, f"✅ {trader}Sold {shares} shares of Option {option} at {fill['price']:.2f} each!", ephemeral=True, priority=PRIORITY_TRADE)
 
 # Update the balance command
-@bot.command()
+@bot.hybrid_command()
 async def balance(ctx):
     """Check your balance, holdings, and prediction stats with role display"""
-    async with aiosqlite.connect('market.db') as db:
+    async with database.reader() as db:
         # Get user data
         user_data = await (await db.execute(
-            "SELECT * FROM users WHERE user_id = ?",
-            (ctx.author.id,)
+            "SELECT balance FROM users WHERE guild_id = ? AND user_id = ?",
+            (ctx.guild.id, ctx.author.id)
         )).fetchone()
-        
-        # Get all resolved questions
+
+        # Get the user's positions in this guild's markets
         cursor = await db.execute(
-            "SELECT question_id, correct_option FROM questions WHERE resolved = TRUE AND correct_option IS NOT NULL"
+            "SELECT h.question_id, h.option, h.qty FROM holdings h "
+            "JOIN questions q ON q.question_id = h.question_id "
+            "WHERE h.user_id = ? AND q.guild_id = ? ORDER BY h.question_id, h.option",
+            (ctx.author.id, ctx.guild.id)
         )
-        resolved_questions = await cursor.fetchall()
+        positions = await cursor.fetchall()
+
+        # Prediction stats are kept up to date at resolution time
+        stats_row = await (await db.execute(
+            "SELECT correct, wrong, attempted FROM user_stats WHERE guild_id = ? AND user_id = ?",
+            (ctx.guild.id, ctx.author.id)
+        )).fetchone()
 
     # Set defaults if user doesn't exist
-    if not user_data:
-        balance = 20.0
-        shares = {}
-        correct = 0
-        wrong = 0
-        total_attempted = 0
-    else:
-        balance = user_data[1]
-        shares = json.loads(user_data[2]) if user_data[2] else {}
-        
-        # Calculate stats
-        correct = 0
-        wrong = 0
-        total_attempted = 0
-        
-        if shares and resolved_questions:
-            for q_id, correct_option in resolved_questions:
-                q_str = str(q_id)
-                if q_str in shares:
-                    user_options = shares[q_str]
-                    for opt in user_options:
-                        total_attempted += 1
-                        if int(opt) == correct_option:
-                            correct += 1
-                        else:
-                            wrong += 1
+    balance = user_data[0] if user_data else 20.0
+    correct, wrong, total_attempted = stats_row if stats_row else (0, 0, 0)
+    shares = {}
+    for q_id, opt, qty in positions:
+        shares.setdefault(q_id, {})[opt] = qty
 
     # Determine user's role and next threshold
     current_tier = None
@@ -666,7 +1119,7 @@ async def balance(ctx):
     )
 
     embed.set_footer(text="Keep predicting to climb the ranks! Use !check_rank to update your role.")
-    await ctx.send(embed=embed)
+    dispatcher.send(ctx, embed=embed)
     
 bot.remove_command('help')
     
@@ -681,10 +1134,14 @@ async def help(ctx):
 
     # Admin commands
     admin_cmds = (
-        "🔹 `!create_question \"Question?\" \"Option1\" \"Option2\" <minutes>`\n"
-        "  Create a new prediction market (Admin only)\n"
+        "🔹 `!create_question \"Question?\" \"Option1\" \"Option2\" <minutes> [liquidity]`\n"
+        "  Create a new prediction market (Admin only, liquidity enables LMSR pricing)\n"
         "🔹 `!resolve <question_id> <correct_option>`\n"
-        "  Resolve a market and distribute winnings (Admin only)"
+        "  Resolve a market and distribute winnings (Admin only)\n"
+        "🔹 `!configure [#channel] [@admin_role] [match ids|all|none]`\n"
+        "  Set this server's auto-market channel, admin role and followed matches (Manage Server)\n"
+        "🔹 `!stats`\n"
+        "  Latency, database and outbound queue stats (Admin only)"
     )
     embed.add_field(name="👑 Admin Commands", value=admin_cmds, inline=False)
 
@@ -695,7 +1152,9 @@ async def help(ctx):
         "🔹 `!buy <question_id> <option_number> <shares>` — Buy shares in a question\n"
         "🔹 `!sell <question_id> <option_number> <shares>` — Sell your shares in a question\n"
         "🔹 `!balance` — Show your coin balance, holdings, and stats\n"
-        "🔹 `!check_rank` — See your current rank and force a role update"
+        "🔹 `!check_rank` — See your current rank and force a role update\n"
+        "🔹 `!history <question_id>` — Chart a market's price history\n"
+        "🔹 `!leaderboard` — Top predictors in this server"
     )
     embed.add_field(name="🧑‍💼 User Commands", value=user_cmds, inline=False)
 
@@ -728,158 +1187,328 @@ async def help(ctx):
     embed.add_field(name="📝 Examples", value=examples, inline=False)
 
     embed.set_footer(text="Good luck! May the odds be ever in your favor. 🎲")
-    await ctx.send(embed=embed)
+    dispatcher.send(ctx, embed=embed)
 
     
-@bot.command()
-async def create_question(ctx, question: str, option1: str, option2: str, minutes: int):
-    # Only allow users with the 'AD' role
+@bot.hybrid_command()
+@app_commands.describe(minutes="Minutes until trading closes", liquidity="LMSR liquidity b; omit for classic pricing")
+async def create_question(ctx, question: str, option1: str, option2: str, minutes: int, liquidity: float = None):
+    """Open a new prediction market (AD role only)"""
+    # Only allow users with the guild's admin role
     if not has_ad_role(ctx):
-        await ctx.send("⛔ You don't have permission to use this command. Only users with the 'AD' role can use it.")
+        dispatcher.send(ctx, admin_only_message(ctx))
+        return
+    # Passing a liquidity parameter b switches the market to LMSR pricing
+    if liquidity is not None and liquidity <= 0:
+        dispatcher.send(ctx, "❌ Liquidity must be positive.")
         return
+    mode = "lmsr" if liquidity is not None else "exp"
+    await ctx.defer()
     try:
         end_time = datetime.now() + timedelta(minutes=minutes)
-        async with aiosqlite.connect('market.db') as db:
+        async with database.writer() as db:
             cursor = await db.execute('''
                 INSERT INTO questions 
-                (channel_id, question_text, option1, option2, end_time)
-                VALUES (?,?,?,?,?)
-            ''', (ctx.channel.id, question, option1, option2, end_time.isoformat()))
+                (guild_id, channel_id, question_text, option1, option2, end_time, pricing, liquidity)
+                VALUES (?,?,?,?,?,?,?,?)
+            ''', (ctx.guild.id, ctx.channel.id, question, option1, option2, to_epoch_ms(end_time), mode, liquidity))
             await db.commit()
             # Get the question_id of the last inserted row
             question_id = cursor.lastrowid
-
-        embed = discord.Embed(
-            title=f"📊 New Prediction Market (ID: {question_id})",
-            description=f"**{question}**\n\n"
-                        f"1️⃣ {option1}\n2️⃣ {option2}\n"
-                        f"⏳ Closes in {minutes} minutes",
-            color=0x00ff00
+        market_engine.add(question_id, (5.0, 5.0), mode, liquidity, ctx.guild.id)
+        price_history.record(question_id, (5.0, 5.0))
+        expiry_scheduler.schedule(question_id, end_time.timestamp())
+        invalidate_market_views(ctx.guild.id, question_id)
+
+        # This message becomes the market's anchor, edited as prices move
+        view = await market_view(question_id)
+        message = await dispatcher.send(
+            ctx,
+            f"📊 **New Prediction Market (ID: {question_id})** • ⏳ Closes in {minutes} minutes",
+            embed=discord.Embed.from_dict(view["embed"]),
+            priority=PRIORITY_ANNOUNCE
         )
-        embed.set_footer(text=f"Question ID: {question_id} • Use this ID to buy shares.")
-        await ctx.send(embed=embed)
+        if message:
+            await anchor_market(question_id, ctx.channel.id, message.id)
     except Exception as e:
-        await ctx.send(f"Error creating question: {str(e)}")
+        dispatcher.send(ctx, f"Error creating question: {str(e)}")
 
-@bot.command()
+async def resolve_market(db, question_id, correct_option):
+    """
+    Settle a market in a single transaction.
+    Pays every winning holder in one statement: the option's final price,
+    or the fixed LMSR_PAYOUT for LMSR markets. Each payout is a ledger entry.
+    Returns: {winning user id: correct predictions}, or None if the market was already settled
+    """
+    await db.execute("BEGIN IMMEDIATE")
+    try:
+        # Idempotency guard: only the first resolution flips correct_option
+        cursor = await db.execute(
+            "UPDATE questions SET correct_option = ?, resolved = TRUE WHERE question_id = ? AND correct_option IS NULL",
+            (correct_option, question_id)
+        )
+        if cursor.rowcount == 0:
+            await db.rollback()
+            return None
+
+        # Payouts go into the ledger first, then are applied to balances
+        await db.execute('''
+            INSERT INTO ledger (guild_id, user_id, kind, amount, question_id, created_at)
+            SELECT q.guild_id, h.user_id, 'payout',
+                   h.qty * (CASE
+                       WHEN q.pricing = 'lmsr' THEN ?
+                       WHEN h.option = 1 THEN q.option1_price
+                       ELSE q.option2_price END),
+                   q.question_id, ?
+            FROM holdings h
+            JOIN questions q ON q.question_id = h.question_id
+            WHERE h.question_id = ? AND h.option = ? AND h.qty > 0
+        ''', (LMSR_PAYOUT, ledger.now_ms(), question_id, correct_option))
+        await db.execute('''
+            UPDATE users
+            SET balance = balance + l.amount
+            FROM ledger l
+            WHERE l.question_id = ? AND l.kind = 'payout'
+              AND l.guild_id = users.guild_id AND l.user_id = users.user_id
+        ''', (question_id,))
+
+        # Every position in this market counts once towards the holder's stats;
+        # user_stats.correct is the one count of correct predictions
+        await db.execute(STATS_UPSERT.format(where="h.question_id = ?"), (question_id,))
+        cursor = await db.execute('''
+            SELECT s.user_id, s.correct
+            FROM ledger l
+            JOIN user_stats s ON s.guild_id = l.guild_id AND s.user_id = l.user_id
+            WHERE l.question_id = ? AND l.kind = 'payout'
+        ''', (question_id,))
+        winners = dict(await cursor.fetchall())
+        await db.commit()
+        return winners
+    except Exception:
+        await db.rollback()
+        raise
+
+
+@bot.hybrid_command()
 @commands.check(has_ad_role)
+@app_commands.describe(question_id="Market to settle", correct_option="Winning option (1 or 2)")
 async def resolve(ctx, question_id: int, correct_option: int):
     """Resolve a prediction market and update user roles"""
     try:
-        async with aiosqlite.connect('market.db') as db:
-            # Get the question with all columns
+        if correct_option not in [1, 2]:
+            dispatcher.send(ctx, "❌ Correct option must be 1 or 2.")
+            return
+        await ctx.defer()
+
+        async with database.reader() as db:
             cursor = await db.execute(
-                "SELECT * FROM questions WHERE question_id = ?", (question_id,)
+                "SELECT 1 FROM questions WHERE question_id = ? AND guild_id = ?",
+                (question_id, ctx.guild.id)
             )
-            question = await cursor.fetchone()
-            
-            if not question:
-                await ctx.send("❌ Invalid question ID.")
-                return
-                
-            # Check if already resolved (column index 8 is 'resolved' BOOLEAN)
-            if question[8]:  # Changed from question[8] is not None
-                await ctx.send("❌ This question has already been resolved.")
-                return
-                
-            if correct_option not in [1, 2]:
-                await ctx.send("❌ Correct option must be 1 or 2.")
+            if not await cursor.fetchone():
+                dispatcher.send(ctx, "❌ Invalid question ID.")
                 return
-                
-            # Column indices for prices (5: option1_price, 6: option2_price)
-            final_price = question[5] if correct_option == 1 else question[6]
-
-            # Process payouts
-            cursor = await db.execute("SELECT * FROM users")
-            users_data = await cursor.fetchall()
-            correct_users = []
-            
-            for user_data in users_data:
-                user_id = user_data[0]
-                shares = json.loads(user_data[2]) if user_data[2] else {}
-                holdings = shares.get(str(question_id), {})
-                
-                if str(correct_option) in holdings:
-                    payout = holdings[str(correct_option)] * final_price
-                    new_balance = user_data[1] + payout
-                    
-                    await db.execute(
-                        "UPDATE users SET balance = ?, correct_predictions = correct_predictions + 1 WHERE user_id = ?",
-                        (new_balance, user_id)
-                    )
-                    correct_users.append(user_id)
-
-            # Update question status (column 9: correct_option, column 8: resolved)
-            await db.execute(
-                "UPDATE questions SET correct_option = ?, resolved = TRUE WHERE question_id = ?",
-                (correct_option, question_id)
-            )
-            await db.commit()
 
+        # Stop trading and flush live prices before paying out at them
+        await market_engine.close(question_id)
+        price_history.forget(question_id)
+
+        async with database.writer() as db:
+            # Expired markets are closed (resolved = TRUE) but still unsettled
+            correct_users = await resolve_market(db, question_id, correct_option)
+        invalidate_market_views(ctx.guild.id, question_id)
+        anchors.touch(question_id)
+
+        if correct_users is None:
+            dispatcher.send(ctx, "❌ This question has already been resolved.")
+            return
+
+        dispatcher.send(ctx, f"✅ Market resolved! Option {correct_option} is correct. Winnings distributed.", priority=PRIORITY_ANNOUNCE)
+
+        leaderboard.update(ctx.guild.id, correct_users)
         # Update roles
-        for user_id in correct_users:
-            await update_user_role(ctx.guild, user_id)
-            
-        await ctx.send(f"✅ Market resolved! Option {correct_option} is correct. Winnings distributed.")
+        await role_sync.sync(ctx.guild, correct_users)
 
     except Exception as e:
-        await ctx.send(f"❌ Error resolving question: {str(e)}")
+        dispatcher.send(ctx, f"❌ Error resolving question: {str(e)}")
 
         
 @bot.event
 async def on_command_error(ctx, error):
+    metrics.inc("command_errors_total", command=ctx.command.qualified_name if ctx.command else "unknown")
     if isinstance(error, commands.MissingPermissions):
         # For admin-only commands
-        await ctx.send("⛔ You don't have permission to use this command. Admin privileges required.")
+        dispatcher.send(ctx, "⛔ You don't have permission to use this command. Admin privileges required.")
     elif isinstance(error, commands.CommandNotFound):
         # For invalid commands
-        await ctx.send("❓ Unknown command. Use `!help` to see available commands.")
+        dispatcher.send(ctx, "❓ Unknown command. Use `!help` to see available commands.")
     elif isinstance(error, commands.MissingRequiredArgument):
         # For commands with missing arguments
-        await ctx.send("⚠️ Missing required argument. Please check command syntax.")
+        dispatcher.send(ctx, "⚠️ Missing required argument. Please check command syntax.")
     else:
         # For other errors
-        await ctx.send(f"❌ An error occurred: {str(error)}")
+        dispatcher.send(ctx, f"❌ An error occurred: {str(error)}")
         
 @bot.command()
 async def give_coins(ctx, member: discord.Member, amount: float):
-    # Check if the invoker has the 'AD' role
-    if not any(role.name == "AD" for role in ctx.author.roles):
-        await ctx.send("⛔ You don't have permission to use this command. Only users with the 'AD' role can use it.")
+    # Check if the invoker has the guild's admin role
+    if not has_ad_role(ctx):
+        dispatcher.send(ctx, admin_only_message(ctx))
         return
     if amount <= 0:
-        await ctx.send("❌ Please specify a positive amount of coins to give.")
+        dispatcher.send(ctx, "❌ Please specify a positive amount of coins to give.")
         return
-    async with aiosqlite.connect('market.db') as db:
+    async with database.writer() as db:
         # Get the user's current balance
         user = await (await db.execute(
-            "SELECT * FROM users WHERE user_id = ?", (member.id,)
+            "SELECT balance FROM users WHERE guild_id = ? AND user_id = ?",
+            (ctx.guild.id, member.id)
         )).fetchone()
         if not user:
-            balance = 20.0 + amount  # If user doesn't exist, start with 20 + amount
+            balance = OPENING_BALANCE + amount  # If user doesn't exist, start with 20 + amount
+            await ledger.record(db, ctx.guild.id, member.id, "opening", OPENING_BALANCE)
         else:
-            balance = user[1] + amount
+            balance = user[0] + amount
+        await ledger.record(db, ctx.guild.id, member.id, "grant", amount)
         await db.execute(
-            "INSERT OR REPLACE INTO users (user_id, balance, shares) VALUES (?, ?, ?)",
-            (member.id, balance, user[2] if user else json.dumps({}))
+            "INSERT INTO users (guild_id, user_id, balance) VALUES (?, ?, ?) "
+            "ON CONFLICT (guild_id, user_id) DO UPDATE SET balance = excluded.balance",
+            (ctx.guild.id, member.id, balance)
         )
         await db.commit()
-    await ctx.send(f"✅ Gave {amount:.2f} coins to {member.mention}. New balance: {balance:.2f} coins.")
+    dispatcher.send(ctx, f"✅ Gave {amount:.2f} coins to {member.mention}. New balance: {balance:.2f} coins.")
     
-@bot.command()
+@bot.hybrid_command()
+@commands.has_permissions(manage_guild=True)
+@app_commands.describe(
+    channel="Channel for auto-generated match markets",
+    admin_role="Role allowed to create and resolve markets",
+    matches="Match IDs to follow, comma separated, or 'all' / 'none'"
+)
+async def configure(ctx, channel: Optional[discord.TextChannel] = None, admin_role: Optional[discord.Role] = None,
+                    *, matches: Optional[str] = None):
+    """Set this server's auto-market channel, admin role and followed matches"""
+    config = guilds.get(ctx.guild.id)
+    followed = config.matches
+    if matches is not None:
+        choice = matches.strip().lower()
+        if choice == "all":
+            followed = None
+        elif choice == "none":
+            followed = ()
+        else:
+            followed = tuple(m.strip() for m in matches.split(",") if m.strip())
+            unknown = [m for m in followed if m not in MATCHES]
+            if unknown:
+                dispatcher.send(
+                    ctx,
+                    f"❌ Unknown match ID(s): {', '.join(unknown)}. "
+                    f"Available: {', '.join(MATCHES) or 'none'}"
+                )
+                return
+    if channel is not None or admin_role is not None or matches is not None:
+        await guilds.update(
+            ctx.guild.id,
+            channel.id if channel else config.market_channel_id,
+            admin_role.name if admin_role else config.admin_role,
+            followed
+        )
+        config = guilds.get(ctx.guild.id)
+    channel_text = f"<#{config.market_channel_id}>" if config.market_channel_id else "not set"
+    if config.matches is None:
+        matches_text = "all"
+    else:
+        matches_text = ", ".join(MATCHES[m]["name"] if m in MATCHES else m for m in config.matches) or "none"
+    dispatcher.send(
+        ctx,
+        f"⚙️ Auto-market channel: {channel_text} | Admin role: `{config.admin_role}` | Matches: {matches_text}"
+    )
+
+
+@bot.hybrid_command()
+@app_commands.describe(question_id="Market ID")
+async def history(ctx, question_id: int):
+    """Chart a market's price history"""
+    async with database.reader() as db:
+        question = await (await db.execute(
+            "SELECT question_text, option1, option2 FROM questions WHERE question_id = ? AND guild_id = ?",
+            (question_id, ctx.guild.id)
+        )).fetchone()
+    if not question:
+        dispatcher.send(ctx, "❌ Invalid question ID!")
+        return
+    qtext, option1, option2 = question
+
+    series = await price_history.get(question_id)
+    if len(series) < 2:
+        dispatcher.send(ctx, "📉 No trades in this market yet.")
+        return
+
+    await ctx.defer()
+    png = await offloader.run(
+        render_chart, series.downsample(200), f"Market #{question_id}", (option1, option2)
+    )
+    embed = discord.Embed(title=f"📈 Price History #{question_id}", description=f"**{qtext}**", color=0x00ff99)
+    if png is not None:
+        embed.set_image(url="attachment://history.png")
+        dispatcher.send(ctx, embed=embed, file=discord.File(io.BytesIO(png), filename="history.png"))
+        return
+
+    # No matplotlib: one sparkline per option
+    small = series.downsample(40)
+    for name, prices in ((option1, small.price1), (option2, small.price2)):
+        embed.add_field(
+            name=f"{name}: {prices[0]:.2f} → {prices[-1]:.2f} (low {min(prices):.2f}, high {max(prices):.2f})",
+            value=f"`{sparkline(prices)}`",
+            inline=False
+        )
+    dispatcher.send(ctx, embed=embed)
+
+
+@bot.hybrid_command(name="leaderboard")
+async def show_leaderboard(ctx):
+    """Top predictors in this server"""
+    entries = leaderboard.get(ctx.guild.id)
+    if not entries:
+        dispatcher.send(ctx, "🏆 No correct predictions yet. Be the first!")
+        return
+    medals = ["🥇", "🥈", "🥉"]
+    lines = []
+    for place, (correct, user_id) in enumerate(entries):
+        badge = medals[place] if place < len(medals) else f"`#{place + 1}`"
+        tier = role_sync.tier_for(correct)
+        lines.append(f"{badge} <@{user_id}> — **{correct}** correct ({tier['name'] if tier else 'Newbie'})")
+    embed = discord.Embed(title="🏆 Leaderboard", description="\n".join(lines), color=0xf1c40f)
+    dispatcher.send(ctx, embed=embed)
+
+
+@bot.hybrid_command()
 async def list_questions(ctx):
     """List all active prediction markets (Available to everyone)"""
-    async with aiosqlite.connect('market.db') as db:
-        now = datetime.now().isoformat()
+    # Time left is shown in minutes, so one render serves the whole minute
+    minute = int(datetime.now().timestamp() // 60)
+    payload = await view_cache.get(
+        ("list", ctx.guild.id), minute, lambda: render_question_list(ctx.guild.id)
+    )
+    if payload is None:
+        dispatcher.send(ctx, "🟡 There are no active prediction questions right now. Use `!create_question` to start one!")
+        return
+    dispatcher.send(ctx, embed=discord.Embed.from_dict(payload))
+
+
+async def render_question_list(guild_id):
+    """Embed payload for !list_questions, or None when nothing is open"""
+    async with database.reader() as db:
+        now = to_epoch_ms(datetime.now())
         cursor = await db.execute(
-            "SELECT question_id, question_text, option1, option2, end_time FROM questions WHERE resolved = FALSE AND end_time > ?",
-            (now,)
+            "SELECT question_id, question_text, option1, option2, end_time FROM questions "
+            "WHERE guild_id = ? AND resolved = FALSE AND end_time > ?",
+            (guild_id, now)
         )
         rows = await cursor.fetchall()
     
     if not rows:
-        await ctx.send("🟡 There are no active prediction questions right now. Use `!create_question` to start one!")
-        return
+        return None
 
     embed = discord.Embed(
         title="🟢 **Active Prediction Markets**",
@@ -887,7 +1516,7 @@ async def list_questions(ctx):
         color=0x00ff99
     )
     for qid, qtext, opt1, opt2, end_time in rows:
-        dt_end = datetime.fromisoformat(end_time)
+        dt_end = from_epoch_ms(end_time)
         remaining = dt_end - datetime.now()
         total_seconds = int(remaining.total_seconds())
         if total_seconds > 0:
@@ -903,40 +1532,245 @@ async def list_questions(ctx):
             inline=False
         )
     embed.set_footer(text="Use !buy <question_id> <option_number> <shares> to participate!")
-    await ctx.send(embed=embed)
-    
-def update_price(old_price, quantity, drastic_factor=0.01):
-    """
-    Update the price of an option. 
-    Use positive quantity for buy, negative for sell.
-    The drastic_factor controls how dramatic the change is.
-    """
-    return max(0.01, old_price * math.exp(drastic_factor * quantity))
+    return embed.to_dict()
 
 
-def update_prices(price1, price2, quantity, bought_option):
-    """
-    Update prices for both options when shares are bought/sold
-    - quantity: positive for buy, negative for sell
-    - bought_option: 1 or 2
-    Returns: (new_price1, new_price2)
-    """
-    drastic_factor = 0.01  # 1% change per share instead of 0.1%
-    
-    if bought_option == 1:
-        new_price1 = price1 * math.exp(drastic_factor * quantity)
-        new_price2 = price2 * math.exp(-drastic_factor * quantity)
+# === SLASH COMMAND AUTOCOMPLETE ===
+async def question_choices(guild_id, current, where):
+    async with database.reader() as db:
+        cursor = await db.execute(
+            f"SELECT question_id, question_text FROM questions WHERE guild_id = ? AND {where} "
+            "AND (CAST(question_id AS TEXT) LIKE ? OR question_text LIKE ?) "
+            "ORDER BY end_time LIMIT 25",
+            (guild_id, f"{current}%", f"%{current}%")
+        )
+        rows = await cursor.fetchall()
+    return [app_commands.Choice(name=f"#{qid}: {text}"[:100], value=qid) for qid, text in rows]
+
+
+@buy.autocomplete("question_id")
+@sell.autocomplete("question_id")
+@market.autocomplete("question_id")
+async def open_question_choices(interaction, current: str):
+    """Open markets matching what has been typed so far, by ID or question text"""
+    return await question_choices(interaction.guild_id, current, "resolved = FALSE")
+
+
+@resolve.autocomplete("question_id")
+async def unsettled_question_choices(interaction, current: str):
+    """Markets still awaiting a result, including closed ones"""
+    return await question_choices(interaction.guild_id, current, "correct_option IS NULL")
+
+
+# Rendered !market and !list_questions embeds
+view_cache = ViewCache()
+
+async def anchor_view(question_id):
+    view = await market_view(question_id)
+    return view["embed"] if view else None
+
+
+# One live message per market, edited at most every few seconds
+anchors = AnchorUpdater(anchor_view, edit_anchor)
+
+
+def invalidate_market_views(guild_id, *question_ids):
+    """Drop cached views after a guild's market opens, closes or settles"""
+    for qid in question_ids:
+        view_cache.invalidate(("market", qid))
+    view_cache.invalidate(("list", guild_id))
+
+
+# Everything outbound goes through here, paced to Discord's rate limits
+dispatcher = Dispatcher()
+
+# Price ticks of every market, written to price_ticks in batches
+price_history = PriceHistory(database)
+
+# Top predictors per guild, updated on each resolution
+leaderboard = Leaderboard(database)
+
+# Folds new ledger entries into balance_snapshots every few minutes
+ledger_snapshots = LedgerSnapshots(database)
+
+
+async def reconcile_balances():
+    """Startup consistency check: every balance must match its ledger"""
+    async with database.writer() as db:
+        mismatches = await ledger.reconcile(db)
+        await ledger.snapshot(db)
+        await db.commit()
+    for guild_id, user_id, stored, expected in mismatches:
+        print(f"Balance of {user_id} in guild {guild_id} was {stored:.2f}, ledger says {expected:.2f}; repaired")
+
+
+# Live prices for open markets, checkpointed back to market.db
+market_engine = MarketEngine(database, pricing_for)
+
+# All buys/sells go through one writer task that group-commits batches;
+# a batch that fails to commit rolls the engine's fills back with it
+trade_queue = TradeQueue(database, apply_trade, journal=market_engine)
+
+
+# === METRICS ===
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+
+@bot.after_invoke
+async def record_command_latency(ctx):
+    started = getattr(ctx, "started_at", None)
+    if metrics.enabled and started is not None:
+        metrics.observe("command_seconds", time.perf_counter() - started, command=ctx.command.qualified_name)
+
+
+def collect_runtime_stats():
+    """Numbers other objects already keep, read only when metrics are scraped"""
+    dispatched = dispatcher.stats()
+    yield "outbound_queued", {}, dispatched["queued"]
+    yield "outbound_calls_total", {}, dispatched["sent"]
+    yield "outbound_merged_total", {}, dispatched["merged"]
+    yield "outbound_failed_total", {}, dispatched["failed"]
+    yield "outbound_dropped_total", {}, dispatched["dropped"]
+    yield "outbound_throttled_total", {}, dispatched["throttled"]
+    yield "outbound_throttle_seconds_total", {}, dispatched["throttle_time"]
+    yield "outbound_max_wait_seconds", {}, dispatched["max_wait"]
+    yield "view_cache_hits_total", {}, view_cache.hits
+    yield "view_cache_misses_total", {}, view_cache.misses
+    yield "db_writer_acquisitions_total", {}, database.write_waits
+    yield "db_writer_wait_seconds_total", {}, database.write_wait_time
+    yield "db_writer_max_wait_seconds", {}, database.max_write_wait
+    yield "open_markets", {}, len(market_engine.markets)
+    yield "score_feed_backlog", {}, score_feed.queue.qsize()
+    yield "scraper_up", {}, int(scraper.running)
+    yield "scraper_restarts_total", {}, scraper.restarts
+    age = scraper.heartbeat_age()
+    if age is not None:
+        yield "scraper_heartbeat_age_seconds", {}, age
+    for match_id, status in scraper.matches.items():
+        yield "scraper_circuit_open", {"match": match_id}, int(status.get("circuit_open", False))
+
+
+metrics.add_collector(collect_runtime_stats)
+
+# Samples event-loop lag twice a second while metrics are on
+loop_lag = LoopLagMonitor(lambda lag: metrics.observe("event_loop_lag_seconds", lag))
+
+
+def start_metrics():
+    if not metrics.enabled:
+        return
+    loop_lag.start()
+    logging.getLogger("discord.http").addHandler(RateLimitLog(metrics))
+
+
+def scraper_status():
+    if not scraper.running:
+        return f"🕷️ Scraper: down · {scraper.restarts} restarts"
+    age = scraper.heartbeat_age()
+    tripped = [m for m, status in scraper.matches.items() if status.get("circuit_open")]
+    line = f"🕷️ Scraper: up · heartbeat {age:.0f}s ago · {scraper.restarts} restarts"
+    if tripped:
+        line += f" · failing: {', '.join(tripped)}"
+    return line
+
+
+def format_latency(histogram):
+    return (f"p50 {histogram.quantile(0.5) * 1000:g} ms · p99 {histogram.quantile(0.99) * 1000:g} ms "
+            f"· n={histogram.count}")
+
+
+@bot.command()
+async def stats(ctx):
+    """Runtime stats for the bot (admin only)"""
+    if not has_ad_role(ctx):
+        dispatcher.send(ctx, admin_only_message(ctx))
+        return
+    dispatched = dispatcher.stats()
+    waits = max(database.write_waits, 1)
+    lookups = max(view_cache.hits + view_cache.misses, 1)
+    lines = [
+        f"📤 Outbound: {dispatched['sent']} calls, {dispatched['merged']} merged, {dispatched['queued']} queued, "
+        f"{dispatched['failed']} failed, {dispatched['dropped']} dropped · throttled {dispatched['throttled']}× ({dispatched['throttle_time']:.1f}s) "
+        f"· avg wait {dispatched['avg_wait']:.2f}s",
+        f"🗄️ Writer lock: {database.write_waits} acquisitions, avg wait {database.write_wait_time / waits * 1000:.2f} ms, "
+        f"max {database.max_write_wait * 1000:.1f} ms",
+        f"🧠 View cache: {view_cache.hits / lookups:.0%} hit rate · 📊 {len(market_engine.markets)} open markets",
+        scraper_status(),
+    ]
+    if metrics.enabled:
+        histograms = metrics.histograms
+        commands_seen = sorted(
+            ((labels, h) for (name, labels), h in histograms.items() if name == "command_seconds"),
+            key=lambda item: -item[1].count
+        )
+        for labels, histogram in commands_seen[:8]:
+            lines.append(f"⌨️ !{dict(labels)['command']}: {format_latency(histogram)}")
+        queries = sorted(
+            ((labels, h) for (name, labels), h in histograms.items() if name == "db_query_seconds"),
+            key=lambda item: -item[1].total
+        )
+        for labels, histogram in queries[:5]:
+            lines.append(f"🐢 {histogram.total:.2f}s total · {format_latency(histogram)}\n   `{dict(labels)['statement']}`")
+        for name, label in (("event_loop_lag_seconds", "⏱️ Loop lag"), ("score_to_market_seconds", "🏏 Score → market")):
+            histogram = histograms.get((name, ()))
+            if histogram:
+                lines.append(f"{label}: {format_latency(histogram)}")
+        limited = metrics.counters.get(("discord_rate_limited_total", ()), 0)
+        lines.append(f"🚦 Discord 429s: {limited}")
     else:
-        new_price1 = price1 * math.exp(-drastic_factor * quantity)
-        new_price2 = price2 * math.exp(drastic_factor * quantity)
-    
-    # Enforce minimum price of 0.5 for both options
-    return max(0.5, new_price1), max(0.5, new_price2)
+        lines.append("Latency histograms are off; set METRICS=1 or METRICS_PORT to enable them.")
+    dispatcher.send(ctx, "\n".join(lines))
 
 
 # Run the bot
-async def main():
+async def start_services(run_scraper=True):
+    """Everything the bot needs besides the gateway connection"""
+    start_metrics()
+    watchdog.start()
+    if metrics.port:
+        await metrics.serve(metrics.port)
     await init_db()
+    await database.open()
+    await guilds.load()
+    await reconcile_balances()
+    ledger_snapshots.start()
+    await score_feed.start()
+    if run_scraper:
+        # One scraper process polls every followed match
+        scraper.start()
+    await market_engine.load()
+    market_engine.start()
+    await schedule_open_markets()
+    await load_anchors()
+    await leaderboard.load()
+    price_history.start()
+    trade_queue.start()
+
+
+async def stop_services():
+    await scraper.stop()
+    await score_feed.stop()
+    await expiry_scheduler.stop()
+    await anchors.stop()
+    for task in list(posting_markets) + list(closing_announcements):
+        task.cancel()
+    await dispatcher.stop()
+    await guilds.stop()
+    await ledger_snapshots.stop()
+    await trade_queue.stop()
+    await market_engine.stop()
+    await price_history.stop()
+    await database.close()
+    await loop_lag.stop()
+    await metrics.stop()
+    await watchdog.stop()
+    await offloader.stop()
+
+
+async def main():
+    await start_services()
     await bot.start('MTM2Mjc3ODIxMjUyNTkzMjY5NA.GNMAYE.tHpMM0QdchSD2mdFVISmTW5Uxvu9wZGJEnbVH8')  # Replace with your actual token
 
 if __name__ == "__main__":
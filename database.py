@@ -0,0 +1,124 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import aiosqlite
+
+
+def statement_label(sql):
+    """Short, stable name for a SQL statement, used as a metrics label"""
+    text = " ".join(sql.split())
+    return text if len(text) <= 80 else text[:77] + "..."
+
+
+class TimedConnection:
+    """A connection whose execute/executemany calls are timed per statement"""
+
+    def __init__(self, conn, metrics, role):
+        self._conn = conn
+        self._metrics = metrics
+        self._role = role
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, sql, parameters=None):
+        with self._metrics.timer("db_query_seconds", role=self._role, statement=statement_label(sql)):
+            return await self._conn.execute(sql, parameters)
+
+    async def executemany(self, sql, parameters):
+        with self._metrics.timer("db_query_seconds", role=self._role, statement=statement_label(sql)):
+            return await self._conn.executemany(sql, parameters)
+
+
+class Database:
+    """
+    Shared SQLite access for the bot.
+    One long-lived writer connection (serialized by a lock) plus a small
+    pool of read-only connections that commands borrow and hand back.
+    """
+
+    def __init__(self, path, readers=4, busy_timeout_ms=5000, cached_statements=256, metrics=None):
+        self.path = path
+        self.reader_count = readers
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cached_statements = cached_statements
+        self._writer = None
+        self._write_lock = asyncio.Lock()
+        self._readers = None
+        self._all_readers = []
+        # Time spent queued for the writer, for load tests and metrics
+        self.write_waits = 0
+        self.write_wait_time = 0.0
+        self.max_write_wait = 0.0
+        self.metrics = metrics  # per-statement timings when enabled
+
+    async def open(self):
+        """Open the writer and the reader pool (call once at startup)"""
+        if self._writer is not None:
+            return
+        # Writer goes first so WAL is enabled before the readers attach
+        self._writer = await self._connect(self.path)
+        try:
+            async with self._writer.execute("PRAGMA journal_mode = WAL") as cursor:
+                await cursor.fetchone()
+
+            self._readers = asyncio.Queue()
+            for _ in range(self.reader_count):
+                conn = await self._connect(f"file:{self.path}?mode=ro", uri=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+        except Exception:
+            await self.close()
+            raise
+
+    async def _connect(self, target, **kwargs):
+        conn = await aiosqlite.connect(
+            target, cached_statements=self.cached_statements, **kwargs
+        )
+        await conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        await conn.execute("PRAGMA synchronous = NORMAL")
+        return conn
+
+    @asynccontextmanager
+    async def writer(self):
+        """Borrow the writer connection; uncommitted work is rolled back on exit"""
+        started = time.perf_counter()
+        async with self._write_lock:
+            waited = time.perf_counter() - started
+            self.write_waits += 1
+            self.write_wait_time += waited
+            self.max_write_wait = max(self.max_write_wait, waited)
+            try:
+                yield self._timed(self._writer, "writer")
+            finally:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+    @asynccontextmanager
+    async def reader(self):
+        """Borrow a read-only connection from the pool"""
+        conn = await self._readers.get()
+        try:
+            yield self._timed(conn, "reader")
+        finally:
+            if conn.in_transaction:
+                await conn.rollback()
+            self._readers.put_nowait(conn)
+
+    def _timed(self, conn, role):
+        if self.metrics is None or not self.metrics.enabled:
+            return conn
+        return TimedConnection(conn, self.metrics, role)
+
+    async def close(self):
+        """Close every connection (safe to call more than once)"""
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        if self._writer is not None:
+            # Hold the lock so an in-flight write finishes first
+            async with self._write_lock:
+                await self._writer.close()
+            self._writer = None
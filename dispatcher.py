@@ -0,0 +1,258 @@
+import asyncio
+import time
+from collections import deque
+
+# Each route keeps one FIFO lane per priority; lower numbers are served first
+PRIORITY_TRADE = 0  # trade confirmations
+PRIORITY_REPLY = 1  # other command replies
+PRIORITY_ANNOUNCE = 2  # new markets, closures, resolutions
+PRIORITY_BACKGROUND = 3  # anything that can wait
+PRIORITIES = (PRIORITY_TRADE, PRIORITY_REPLY, PRIORITY_ANNOUNCE, PRIORITY_BACKGROUND)
+
+# Tokens each lane may spend per round while the route is backlogged, so a
+# busy lane still leaves announcements a share of the channel's rate
+LANE_SHARES = (4, 2, 3, 1)
+# Replies stop being worth sending after a while. Trade confirmations are
+# never dropped (they merge instead) and neither are announcements
+DROPPABLE = (PRIORITY_REPLY,)
+
+MESSAGE_LIMIT = 2000  # Discord's cap on message content
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is now)"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class Outbound:
+    __slots__ = ("priority", "target", "content", "kwargs", "action", "future", "enqueued", "fallback")
+
+    def __init__(self, priority, target, content, kwargs, action, future, fallback=None):
+        self.priority = priority
+        self.target = target
+        self.content = content
+        self.kwargs = kwargs
+        self.action = action
+        self.future = future
+        self.enqueued = time.monotonic()
+        self.fallback = fallback  # text that can stand in for the action in a merged message
+
+    @property
+    def text(self):
+        return self.fallback if self.action is not None else self.content
+
+    @property
+    def mergeable(self):
+        if self.action is not None:
+            return bool(self.fallback)
+        return not self.kwargs and bool(self.content)
+
+
+class Dispatcher:
+    """
+    Central queue for everything the bot sends to Discord.
+    Each route (a channel, or a guild for guild-wide actions) drains through its own
+    token bucket plus one shared by the whole guild, so bursts wait here
+    instead of running into rate limits. Lanes are served by priority, but
+    while a route is backlogged each lane only gets its LANE_SHARES of the
+    tokens per round, so sustained trading cannot starve announcements.
+    Replies older than `stale_after` seconds are dropped, and so are the
+    oldest replies once a route holds `max_queued` jobs; trade confirmations
+    and announcements always go out. Plain text messages queued for the
+    same channel go out merged into one, and so do queued calls that have
+    a text fallback (trade reactions). Ephemeral only applies to slash
+    replies, so the flag is ignored for everything that queues.
+    Replies to slash commands skip the queue.
+    send() and call() return a future right away; await it only if you need
+    the resulting message. Failures are logged and resolve to None.
+    """
+
+    def __init__(self, channel_rate=1.0, channel_burst=5, guild_rate=10.0, guild_burst=20,
+                 stale_after=30.0, max_queued=100):
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.guild_rate = guild_rate
+        self.guild_burst = guild_burst
+        self.stale_after = stale_after
+        self.max_queued = max_queued
+        self._lanes = {}  # route id -> one deque of Outbound per priority
+        self._credits = {}  # route id -> tokens each lane has left this round
+        self._workers = {}  # route id -> drain task
+        self._direct = set()  # slash reply deliveries in flight, kept so they aren't collected
+        self._buckets = {}  # route id -> TokenBucket
+        self._guild_buckets = {}  # guild id -> TokenBucket
+        # Metrics
+        self.sent = 0  # API calls made
+        self.merged = 0  # messages folded into another one
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.failed = 0  # API calls that raised
+        self.throttled = 0  # times a lane slept for its token buckets
+        self.throttle_time = 0.0
+        self.dropped = 0  # stale or overflowing replies never sent
+
+    def send(self, destination, content=None, *, priority=PRIORITY_REPLY, **kwargs):
+        """Queue destination.send(content, **kwargs); destination is a channel or context"""
+        return self._enqueue(destination, priority, content, kwargs, None)
+
+    def call(self, destination, action, *, priority=PRIORITY_BACKGROUND, fallback=None):
+        """
+        Queue `await action()` under destination's limits (a channel, context or guild).
+        With `fallback` text, a call that has to queue behind other messages is sent
+        as that text, merged with them, instead of costing a request of its own.
+        """
+        return self._enqueue(destination, priority, None, None, action, fallback)
+
+    def queue_depth(self):
+        return sum(len(lane) for lanes in self._lanes.values() for lane in lanes)
+
+    def stats(self):
+        return {
+            "queued": self.queue_depth(),
+            "sent": self.sent,
+            "merged": self.merged,
+            "avg_wait": self.total_wait / (self.sent + self.merged) if self.sent else 0.0,
+            "max_wait": self.max_wait,
+            "failed": self.failed,
+            "throttled": self.throttled,
+            "throttle_time": self.throttle_time,
+            "dropped": self.dropped,
+        }
+
+    async def stop(self):
+        for task in list(self._workers.values()) + list(self._direct):
+            task.cancel()
+        self._workers.clear()
+        self._lanes.clear()
+        self._credits.clear()
+
+    def _enqueue(self, destination, priority, content, kwargs, action, fallback=None):
+        channel = getattr(destination, "channel", destination)
+        guild = getattr(channel, "guild", None)
+        route = channel.id
+        future = asyncio.get_running_loop().create_future()
+        if getattr(destination, "interaction", None) is not None:
+            job = Outbound(priority, destination, content, kwargs, action, future)
+            # Slash command replies have their own limits and a 3 second deadline
+            task = asyncio.create_task(self._deliver([job]))
+            self._direct.add(task)
+            task.add_done_callback(self._direct.discard)
+            return future
+        if kwargs:
+            # Only interaction responses can be ephemeral; dropping the flag lets the reply merge
+            kwargs = {k: v for k, v in kwargs.items() if k != "ephemeral"}
+        job = Outbound(priority, destination, content, kwargs, action, future, fallback)
+        lanes = self._lanes.get(route)
+        if lanes is None:
+            lanes = self._lanes[route] = [deque() for _ in PRIORITIES]
+            self._credits[route] = list(LANE_SHARES)
+        if sum(len(lane) for lane in lanes) >= self.max_queued:
+            # Full: make room by dropping the oldest plain reply
+            for p in reversed(DROPPABLE):
+                if lanes[p]:
+                    self._drop(lanes[p].popleft())
+                    break
+        lanes[priority].append(job)
+        if route not in self._workers:
+            self._workers[route] = asyncio.create_task(
+                self._drain(route, guild.id if guild else None)
+            )
+        return future
+
+    def _drop(self, job):
+        self.dropped += 1
+        if not job.future.done():
+            job.future.set_result(None)
+
+    def _next_lane(self, route):
+        """The lane to serve next: highest priority with tokens left this round"""
+        lanes = self._lanes[route]
+        credits = self._credits[route]
+        deadline = time.monotonic() - self.stale_after
+        for p in DROPPABLE:
+            while lanes[p] and lanes[p][0].enqueued < deadline:
+                self._drop(lanes[p].popleft())
+        waiting = [p for p in PRIORITIES if lanes[p]]
+        if not waiting:
+            return None
+        if not any(credits[p] for p in waiting):
+            credits[:] = LANE_SHARES  # every waiting lane spent its share: new round
+        return next(p for p in waiting if credits[p])
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    async def _drain(self, route, guild_id):
+        lanes = self._lanes[route]
+        bucket = self._bucket(self._buckets, route, self.channel_rate, self.channel_burst)
+        guild_bucket = self._bucket(self._guild_buckets, guild_id, self.guild_rate, self.guild_burst)
+        try:
+            while True:
+                delay = max(bucket.wait_time(), guild_bucket.wait_time())
+                if delay > 0:
+                    self.throttled += 1
+                    self.throttle_time += delay
+                    await asyncio.sleep(delay)
+                    continue  # something more urgent may have arrived meanwhile
+                priority = self._next_lane(route)
+                if priority is None:
+                    break
+                bucket.take()
+                guild_bucket.take()
+                self._credits[route][priority] -= 1
+
+                lane = lanes[priority]
+                jobs = [lane.popleft()]
+                if jobs[0].mergeable:
+                    length = len(jobs[0].text)
+                    while lane and lane[0].mergeable and length + 1 + len(lane[0].text) <= MESSAGE_LIMIT:
+                        length += 1 + len(lane[0].text)
+                        jobs.append(lane.popleft())
+                await self._deliver(jobs)
+        finally:
+            if self._workers.get(route) is asyncio.current_task():
+                del self._workers[route]
+            if not any(lanes):
+                self._lanes.pop(route, None)
+                self._credits.pop(route, None)
+
+    async def _deliver(self, jobs):
+        first = jobs[0]
+        now = time.monotonic()
+        for job in jobs:
+            wait = now - job.enqueued
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+        self.sent += 1
+        self.merged += len(jobs) - 1
+
+        result = None
+        try:
+            if len(jobs) > 1:
+                result = await first.target.send("\n".join(job.text for job in jobs))
+            elif first.action is not None:
+                result = await first.action()
+            else:
+                result = await first.target.send(first.content, **first.kwargs)
+        except Exception as e:
+            self.failed += 1
+            print(f"Error sending to Discord: {str(e)}")
+        for job in jobs:
+            if not job.future.done():
+                job.future.set_result(result)
@@ -0,0 +1,201 @@
+import asyncio
+import time
+
+
+class MarketState:
+    """Live state of one open market"""
+    __slots__ = ("question_id", "guild_id", "prices", "pricing", "outstanding", "last_trade", "version", "dirty", "lock")
+
+    def __init__(self, question_id, prices, pricing, outstanding=(0.0, 0.0), guild_id=None):
+        self.question_id = question_id
+        self.guild_id = guild_id
+        self.prices = tuple(prices)
+        self.pricing = pricing  # fill(prices, option, quantity) -> (fill_price, new_prices)
+        self.outstanding = list(outstanding)  # shares held per option
+        self.last_trade = None
+        self.version = 0  # bumped on every fill
+        self.dirty = False  # prices changed since the last checkpoint
+        self.lock = asyncio.Lock()
+
+
+class MarketEngine:
+    """
+    Quotes and fills trades for open markets in memory.
+    Prices are written back to market.db by a background checkpoint, either
+    every checkpoint_interval seconds or after checkpoint_every fills.
+    Fills made between begin() and rollback() are undone, so a trade batch
+    whose transaction fails leaves no trace in the live markets.
+    """
+
+    def __init__(self, database, pricing_for, checkpoint_interval=2.0, checkpoint_every=50):
+        self.database = database
+        self.pricing_for = pricing_for  # (mode, liquidity) -> pricing model
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoint_every = checkpoint_every
+        self.markets = {}
+        self._fills_since_checkpoint = 0
+        self._flush_now = asyncio.Event()
+        self._undo = None  # question_id -> (market, state before the batch) while a batch is open
+        self._unsaved = {}  # question_id -> closed market whose final prices failed to write
+        self._task = None
+
+    async def load(self):
+        """Rebuild live state for every open market from the database"""
+        async with self.database.reader() as db:
+            cursor = await db.execute(
+                "SELECT question_id, option1_price, option2_price, pricing, liquidity, guild_id FROM questions WHERE resolved = FALSE"
+            )
+            rows = await cursor.fetchall()
+            cursor = await db.execute(
+                """
+                SELECT h.question_id, h.option, SUM(h.qty) FROM holdings h
+                JOIN questions q ON q.question_id = h.question_id
+                WHERE q.resolved = FALSE
+                GROUP BY h.question_id, h.option
+                """
+            )
+            totals = await cursor.fetchall()
+
+        self.markets = {
+            qid: MarketState(qid, (p1, p2), self.pricing_for(mode, liquidity), guild_id=guild_id)
+            for qid, p1, p2, mode, liquidity, guild_id in rows
+        }
+        for qid, option, qty in totals:
+            if qid in self.markets and option in (1, 2):
+                self.markets[qid].outstanding[option - 1] = qty
+
+    def add(self, question_id, prices, mode="exp", liquidity=None, guild_id=None):
+        """Register a newly created market"""
+        self.markets[question_id] = MarketState(
+            question_id, prices, self.pricing_for(mode, liquidity), guild_id=guild_id
+        )
+
+    def get(self, question_id):
+        return self.markets.get(question_id)
+
+    def quote(self, question_id):
+        """Current prices of an open market, or None"""
+        market = self.markets.get(question_id)
+        return market.prices if market else None
+
+    def quote_sizes(self, question_id, option, sizes):
+        """Total cost of buying each of `sizes` shares of option right now, or None"""
+        market = self.markets.get(question_id)
+        return market.pricing.quote(market.prices, option, sizes) if market else None
+
+    async def fill(self, question_id, option, quantity, settle):
+        """
+        Price a trade against the live market and apply it.
+        settle(fill_price, new_prices) persists the user's side of the trade;
+        if it raises, the market state is left untouched.
+        Returns: (fill_price, new_prices, settle_result), or None for unknown markets
+        """
+        market = self.markets.get(question_id)
+        if market is None:
+            return None
+
+        async with market.lock:
+            if self.markets.get(question_id) is not market:
+                return None  # closed while we waited
+            fill_price, new_prices = market.pricing.fill(market.prices, option, quantity)
+            result = await settle(fill_price, new_prices)
+            if self._undo is not None and question_id not in self._undo:
+                self._undo[question_id] = (market, self._snapshot(market))
+            market.prices = new_prices
+            market.outstanding[option - 1] += quantity
+            market.last_trade = time.time()
+            market.version += 1
+            market.dirty = True
+
+        self._fills_since_checkpoint += 1
+        if self._fills_since_checkpoint >= self.checkpoint_every:
+            self._flush_now.set()
+        return fill_price, new_prices, result
+
+    def begin(self):
+        """Start a batch: remember each market's state before its first fill"""
+        self._undo = {}
+
+    def commit(self):
+        """The batch is durable; forget the saved states"""
+        self._undo = None
+
+    def rollback(self):
+        """The batch failed: put every market it filled back as it was"""
+        undo, self._undo = self._undo or {}, None
+        for market, (prices, outstanding, last_trade, version, dirty) in undo.values():
+            market.prices = prices
+            market.outstanding = outstanding
+            market.last_trade = last_trade
+            market.version = version
+            market.dirty = dirty
+
+    @staticmethod
+    def _snapshot(market):
+        return market.prices, list(market.outstanding), market.last_trade, market.version, market.dirty
+
+    async def close(self, question_id):
+        """Stop trading a market and persist its final prices (call again if this raises)"""
+        market = self.markets.pop(question_id, None) or self._unsaved.pop(question_id, None)
+        if market is None:
+            return
+        # Wait for an in-flight fill, but don't hold the lock while writing:
+        # the trade writer may be holding the database while it fills
+        async with market.lock:
+            pass
+        if market.dirty:
+            try:
+                await self._write([market])
+            except Exception:
+                self._unsaved[question_id] = market  # still closed; the retry writes it
+                raise
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.checkpoint()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), self.checkpoint_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                print(f"Error checkpointing markets: {str(e)}")
+
+    async def checkpoint(self):
+        """Write the prices of every market that traded since the last checkpoint"""
+        self._flush_now.clear()
+        self._fills_since_checkpoint = 0
+        dirty = [m for m in self.markets.values() if m.dirty]
+        if dirty:
+            await self._write(dirty)
+
+    async def _write(self, markets):
+        for m in markets:
+            m.dirty = False
+        try:
+            async with self.database.writer() as db:
+                # Read the prices only once the trade writer is done, in case its batch rolled back
+                rows = [(m.prices[0], m.prices[1], m.question_id) for m in markets]
+                await db.executemany(
+                    "UPDATE questions SET option1_price = ?, option2_price = ? WHERE question_id = ?",
+                    rows
+                )
+                await db.commit()
+        except Exception:
+            for m in markets:
+                m.dirty = True
+            raise
@@ -0,0 +1,69 @@
+import asyncio
+import heapq
+import time
+
+
+class ExpiryScheduler:
+    """
+    Closes markets at their deadline.
+    Deadlines sit in a min-heap; one task sleeps until the earliest one and
+    hands every market due within the same tick to on_expire as one batch.
+    If on_expire fails, the batch is scheduled again `retry_delay` seconds later.
+    """
+
+    def __init__(self, on_expire, tick=0.05, retry_delay=5.0):
+        self.on_expire = on_expire  # async (list of question ids) -> None
+        self.tick = tick
+        self.retry_delay = retry_delay
+        self._heap = []  # (deadline epoch seconds, question_id)
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def schedule(self, question_id, deadline):
+        """Register a market closing at deadline (epoch seconds)"""
+        earliest = self._heap[0][0] if self._heap else None
+        heapq.heappush(self._heap, (deadline, question_id))
+        if earliest is None or deadline < earliest:
+            self._wake.set()  # the sleeper needs a shorter timeout
+
+    def __len__(self):
+        return len(self._heap)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait()
+                continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                    continue  # an earlier deadline arrived; re-check
+                except asyncio.TimeoutError:
+                    pass
+
+            cutoff = time.time() + self.tick
+            due = []
+            while self._heap and self._heap[0][0] <= cutoff:
+                due.append(heapq.heappop(self._heap)[1])
+            try:
+                await self.on_expire(due)
+            except Exception as e:
+                print(f"Error closing expired markets {due}: {str(e)}; retrying in {self.retry_delay:g}s")
+                retry_at = time.time() + self.retry_delay
+                for question_id in due:
+                    heapq.heappush(self._heap, (retry_at, question_id))
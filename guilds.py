@@ -0,0 +1,87 @@
+import asyncio
+
+DEFAULT_ADMIN_ROLE = "AD"
+
+
+class GuildConfig:
+    __slots__ = ("guild_id", "market_channel_id", "admin_role", "matches")
+
+    def __init__(self, guild_id, market_channel_id=None, admin_role=DEFAULT_ADMIN_ROLE, matches=None):
+        self.guild_id = guild_id
+        self.market_channel_id = market_channel_id  # where auto-generated markets are posted
+        self.admin_role = admin_role or DEFAULT_ADMIN_ROLE  # role allowed to run admin commands
+        # Match ids that get auto markets here, stored comma separated; None follows every match
+        self.matches = None if matches is None else tuple(m for m in matches.split(",") if m)
+
+    def follows(self, match_id):
+        return self.matches is None or match_id in self.matches
+
+
+class GuildRegistry:
+    """
+    Per-guild configuration, cached from the guild_config table, and one
+    background worker per guild.
+    Work submitted for a guild runs in order on that guild's worker, so a
+    slow guild never holds up the others.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.configs = {}  # guild id -> GuildConfig
+        self._queues = {}  # guild id -> asyncio.Queue of coroutine functions
+        self._workers = {}  # guild id -> worker task
+
+    async def load(self):
+        async with self.database.reader() as db:
+            cursor = await db.execute(
+                "SELECT guild_id, market_channel_id, admin_role, matches FROM guild_config"
+            )
+            rows = await cursor.fetchall()
+        self.configs = {row[0]: GuildConfig(*row) for row in rows}
+
+    def get(self, guild_id):
+        return self.configs.get(guild_id) or GuildConfig(guild_id)
+
+    def market_channels(self, match_id):
+        """Channel ids of every guild that wants auto-generated markets for match_id"""
+        return [
+            c.market_channel_id for c in self.configs.values()
+            if c.market_channel_id and c.follows(match_id)
+        ]
+
+    async def update(self, guild_id, market_channel_id, admin_role, matches=None):
+        """matches: match ids to follow, or None for all of them"""
+        stored = None if matches is None else ",".join(matches)
+        async with self.database.writer() as db:
+            await db.execute('''
+                INSERT INTO guild_config (guild_id, market_channel_id, admin_role, matches)
+                VALUES (?,?,?,?)
+                ON CONFLICT (guild_id) DO UPDATE SET
+                    market_channel_id = excluded.market_channel_id,
+                    admin_role = excluded.admin_role,
+                    matches = excluded.matches
+            ''', (guild_id, market_channel_id, admin_role, stored))
+            await db.commit()
+        self.configs[guild_id] = GuildConfig(guild_id, market_channel_id, admin_role, stored)
+
+    def submit(self, guild_id, work):
+        """Run `await work()` on guild_id's worker"""
+        queue = self._queues.get(guild_id)
+        if queue is None:
+            queue = self._queues[guild_id] = asyncio.Queue()
+            self._workers[guild_id] = asyncio.create_task(self._run(guild_id, queue))
+        queue.put_nowait(work)
+
+    async def stop(self):
+        for task in self._workers.values():
+            task.cancel()
+        self._workers.clear()
+        self._queues.clear()
+
+    async def _run(self, guild_id, queue):
+        while True:
+            work = await queue.get()
+            try:
+                await work()
+            except Exception as e:
+                print(f"Error in background work for guild {guild_id}: {str(e)}")
@@ -0,0 +1,40 @@
+class Leaderboard:
+    """
+    Top-N users per guild by correct predictions.
+    Built once at startup; afterwards only resolutions change the counts,
+    and they only ever go up, so merging each resolution's winners into
+    the current top N keeps it exact without re-sorting user_stats.
+    """
+
+    def __init__(self, database, size=10):
+        self.database = database
+        self.size = size
+        self.top = {}  # guild id -> [(correct, user_id)] best first
+
+    async def load(self):
+        async with self.database.reader() as db:
+            cursor = await db.execute('''
+                SELECT guild_id, user_id, correct FROM (
+                    SELECT guild_id, user_id, correct,
+                           ROW_NUMBER() OVER (
+                               PARTITION BY guild_id ORDER BY correct DESC, user_id
+                           ) AS place
+                    FROM user_stats WHERE correct > 0
+                ) WHERE place <= ?
+            ''', (self.size,))
+            rows = await cursor.fetchall()
+        self.top = {}
+        for guild_id, user_id, correct in rows:
+            self.top.setdefault(guild_id, []).append((correct, user_id))
+        for entries in self.top.values():
+            entries.sort(key=lambda e: (-e[0], e[1]))
+
+    def update(self, guild_id, counts):
+        """Merge {user_id: new correct count} from a resolution"""
+        merged = {user_id: correct for correct, user_id in self.top.get(guild_id, [])}
+        merged.update(counts)
+        entries = sorted(((c, u) for u, c in merged.items() if c > 0), key=lambda e: (-e[0], e[1]))
+        self.top[guild_id] = entries[:self.size]
+
+    def get(self, guild_id):
+        return self.top.get(guild_id, [])
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+# Every new account starts with this many coins, recorded as an 'opening' entry
+OPENING_BALANCE = 20.0
+
+# Entry kinds: opening, buy, sell, payout, grant. amount is the signed
+# change to the user's balance; users.balance is the running total.
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+async def record(db, guild_id, user_id, kind, amount, question_id=None):
+    """Append one entry; call inside the transaction that changes users.balance"""
+    await db.execute(
+        "INSERT INTO ledger (guild_id, user_id, kind, amount, question_id, created_at) VALUES (?,?,?,?,?,?)",
+        (guild_id, user_id, kind, amount, question_id, now_ms())
+    )
+
+
+async def snapshot(db):
+    """
+    Fold every entry since the last snapshot into balance_snapshots.
+    Only the new entries are read, so this stays cheap however long the
+    ledger grows. Returns: the entry id the snapshot now covers.
+    """
+    cursor = await db.execute("SELECT snapshot_entry_id FROM ledger_meta")
+    since = (await cursor.fetchone())[0]
+    cursor = await db.execute("SELECT COALESCE(MAX(entry_id), 0) FROM ledger")
+    upto = (await cursor.fetchone())[0]
+    if upto == since:
+        return since
+    await db.execute('''
+        INSERT INTO balance_snapshots (guild_id, user_id, balance)
+        SELECT guild_id, user_id, SUM(amount) FROM ledger
+        WHERE entry_id > ? AND entry_id <= ?
+        GROUP BY guild_id, user_id
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET balance = balance + excluded.balance
+    ''', (since, upto))
+    await db.execute("UPDATE ledger_meta SET snapshot_entry_id = ?", (upto,))
+    return upto
+
+
+async def reconcile(db, repair=True, tolerance=1e-6):
+    """
+    Check users.balance against the last snapshot plus the entries after it.
+    With repair, drifted balances are reset to what the ledger says.
+    Returns: list of (guild_id, user_id, stored balance, ledger balance)
+    """
+    cursor = await db.execute('''
+        WITH recent AS (
+            SELECT guild_id, user_id, SUM(amount) AS delta FROM ledger
+            WHERE entry_id > (SELECT snapshot_entry_id FROM ledger_meta)
+            GROUP BY guild_id, user_id
+        )
+        SELECT u.guild_id, u.user_id, u.balance,
+               COALESCE(s.balance, 0) + COALESCE(r.delta, 0) AS expected
+        FROM users u
+        LEFT JOIN balance_snapshots s ON s.guild_id = u.guild_id AND s.user_id = u.user_id
+        LEFT JOIN recent r ON r.guild_id = u.guild_id AND r.user_id = u.user_id
+        WHERE ABS(u.balance - (COALESCE(s.balance, 0) + COALESCE(r.delta, 0))) > ?
+    ''', (tolerance,))
+    mismatches = await cursor.fetchall()
+    if repair and mismatches:
+        await db.executemany(
+            "UPDATE users SET balance = ? WHERE guild_id = ? AND user_id = ?",
+            [(expected, guild_id, user_id) for guild_id, user_id, _, expected in mismatches]
+        )
+    return mismatches
+
+
+class LedgerSnapshots:
+    """Takes a ledger snapshot every `interval` seconds in the background"""
+
+    def __init__(self, database, interval=300.0):
+        self.database = database
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                async with self.database.writer() as db:
+                    await snapshot(db)
+                    await db.commit()
+            except Exception as e:
+                print(f"Error taking ledger snapshot: {str(e)}")
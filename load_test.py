@@ -0,0 +1,402 @@
+"""
+Offline replay and load test for the bot.
+
+Drives the real command callbacks (buy, sell, market, balance, create_question,
+resolve) and the auto-market loop with fake guilds, members and channels, while
+a recorded score stream is replayed at up to 1000x speed. Nothing connects to
+Discord or crex.com, and the bot works on a temporary copy of the database.
+
+    python3 load_test.py --traders 200 --speed 500 --guilds 3
+
+Reports p50/p99 latency per command, filled trades per second, time spent
+waiting for the database writer and event-loop lag. The run fails if an
+auto market was never opened or posted, or the outbound queue hasn't emptied
+within --drain seconds; with --strict-ms it also fails if any step blocked
+the event loop for longer than that.
+"""
+import argparse
+import asyncio
+import csv
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from metrics import LoopLagMonitor
+from offload import BlockedLoop
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOAD_TEST_GUILD_BASE = 9_000_000_000  # fake ids, clear of real snowflakes in a copied database
+LOAD_TEST_USER_BASE = 9_100_000_000
+
+
+# === FAKE DISCORD OBJECTS ===
+async def _noop(*args, **kwargs):
+    pass
+
+
+class FakeRole:
+    def __init__(self, name, position=1, color=None):
+        self.name = name
+        self.position = position
+        self.color = color
+
+    async def edit(self, **kwargs):
+        if "position" in kwargs:
+            self.position = kwargs["position"]
+
+
+class FakeMember:
+    def __init__(self, user_id, roles=()):
+        self.id = user_id
+        self.roles = list(roles)
+        self.display_name = self.name = f"trader{user_id}"
+        self.mention = f"<@{user_id}>"
+
+    async def add_roles(self, *roles, **kwargs):
+        self.roles.extend(roles)
+
+    async def remove_roles(self, *roles, **kwargs):
+        self.roles = [r for r in self.roles if r not in roles]
+
+
+class FakeMessage:
+    def __init__(self, message_id):
+        self.id = message_id
+        self.edit = _noop
+        self.add_reaction = _noop
+        self.pin = _noop
+
+
+class FakeChannel:
+    """Counts what the bot sends instead of delivering it"""
+
+    def __init__(self, channel_id, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.sent = 0
+        self.edits = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self.id * 1000 + self.sent)
+
+    def get_partial_message(self, message_id):
+        message = FakeMessage(message_id)
+
+        async def edit(**kwargs):
+            self.edits += 1
+        message.edit = edit
+        return message
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.roles = []
+        self.members = {}
+        self.me = FakeMember(0, [FakeRole("bot", 100)])
+        self.me.top_role = self.me.roles[0]
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id):
+        return self.members.setdefault(user_id, FakeMember(user_id))
+
+    async def create_role(self, name, **kwargs):
+        role = FakeRole(name, 50, kwargs.get("color"))
+        self.roles.append(role)
+        return role
+
+
+class FakeContext:
+    """Enough of commands.Context for the command callbacks"""
+
+    def __init__(self, author, guild, channel, slash=False):
+        self.author = author
+        self.guild = guild
+        self.channel = channel
+        self.interaction = object() if slash else None
+        self.message = FakeMessage(0)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def reply(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+# === MEASUREMENT ===
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class Timings:
+    def __init__(self):
+        self.samples = {}  # command name -> [seconds]
+
+    async def run(self, name, callback, ctx, *args):
+        started = time.perf_counter()
+        try:
+            await callback(ctx, *args)
+        except Exception as e:
+            print(f"Error in {name}: {str(e)}")
+        self.samples.setdefault(name, []).append(time.perf_counter() - started)
+
+
+# === SCENARIO ===
+def copy_database(source, target):
+    """Consistent copy of a live database, WAL included"""
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def load_score_rows(path):
+    from score_feed import infer_innings, parse_row
+    with open(path, newline="") as f:
+        events = [e for e in (parse_row(row) for row in csv.reader(f)) if e]
+    infer_innings(events)
+    return events
+
+
+def expected_markets(rows):
+    """Auto markets one followed match opens: one per new (innings, over) after the first row"""
+    last, count = None, 0
+    for event in rows:
+        position = (event["innings"], event["overs"])
+        if last is None or position > last:
+            count += last is not None
+            last = position
+    return count
+
+
+async def replay(bot_module, match_id, rows, over_seconds, speed):
+    """Publish score rows as the scraper would, with the gaps between overs scaled by speed"""
+    previous = None
+    for event in rows:
+        if previous is not None:
+            await asyncio.sleep(max(0.0, event["overs"] - previous) * over_seconds / speed)
+        previous = event["overs"]
+        bot_module.score_feed.publish(dict(event, match_id=match_id))
+
+
+async def drain_outbound(bot_module, timeout):
+    """Wait for the outbound queue to empty and new markets to be anchored; False on timeout"""
+    deadline = time.perf_counter() + timeout
+    while bot_module.dispatcher.queue_depth() and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    if bot_module.dispatcher.queue_depth():
+        return False
+    await asyncio.gather(*bot_module.posting_markets)
+    return True
+
+
+def open_markets(bot_module, guild_id):
+    return [qid for qid, m in bot_module.market_engine.markets.items() if m.guild_id == guild_id]
+
+
+async def trader(bot_module, timings, ctx, think, done, rng):
+    holdings = {}  # (question_id, option) -> shares bought in this run
+    while not done.is_set():
+        await asyncio.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+        markets = open_markets(bot_module, ctx.guild.id)
+        if not markets:
+            continue
+        question_id = rng.choice(markets)
+        roll = rng.random()
+        if roll < 0.45:
+            option, shares = rng.choice((1, 2)), round(rng.uniform(0.1, 1.0), 2)
+            await timings.run("buy", bot_module.buy.callback, ctx, question_id, option, shares)
+            holdings[(question_id, option)] = holdings.get((question_id, option), 0) + shares
+        elif roll < 0.7 and holdings:
+            (question_id, option), shares = rng.choice(list(holdings.items()))
+            await timings.run("sell", bot_module.sell.callback, ctx, question_id, option, shares / 2)
+            holdings[(question_id, option)] = shares / 2
+        elif roll < 0.9:
+            await timings.run("market", bot_module.market.callback, ctx, question_id)
+        else:
+            await timings.run("balance", bot_module.balance.callback, ctx)
+
+
+async def run(args):
+    import bot as bot_module
+    rng = random.Random(args.seed)
+    timings = Timings()
+
+    # Fake guilds, each with one market channel, an admin and its traders
+    guilds, channels, admins, traders = [], {}, [], []
+    for g in range(args.guilds):
+        guild = FakeGuild(LOAD_TEST_GUILD_BASE + g)
+        channel = FakeChannel(LOAD_TEST_GUILD_BASE + 1000 + g, guild)
+        admin = FakeMember(LOAD_TEST_USER_BASE - 1 - g, [FakeRole("AD")])
+        guild.members[admin.id] = admin
+        guilds.append(guild)
+        channels[channel.id] = channel
+        admins.append(FakeContext(admin, guild, channel))
+    for t in range(args.traders):
+        guild = guilds[t % len(guilds)]
+        member = FakeMember(LOAD_TEST_USER_BASE + t)
+        guild.members[member.id] = member
+        channel = next(c for c in channels.values() if c.guild is guild)
+        traders.append(FakeContext(member, guild, channel, slash=rng.random() < args.slash))
+    bot_module.bot.get_channel = channels.get
+    bot_module.bot.wait_until_ready = _noop  # there is no gateway to wait for
+
+    if args.strict_ms:
+        bot_module.watchdog.threshold = args.strict_ms / 1000
+        bot_module.watchdog.strict = True
+    await bot_module.start_services(run_scraper=False)
+    bot_module.expiry_scheduler.start()
+    for guild, channel in zip(guilds, channels.values()):
+        await bot_module.guilds.update(guild.id, channel.id, "AD")
+    for ctx in traders:
+        admin = admins[guilds.index(ctx.guild)]
+        await bot_module.give_coins.callback(admin, ctx.author, args.coins)
+    for admin in admins:
+        await bot_module.create_question.callback(admin, "Load test market", "Yes", "No", 60, 50.0)
+
+    database = bot_module.database
+    database.write_waits, database.write_wait_time, database.max_write_wait = 0, 0.0, 0.0
+    async with database.reader() as db:
+        cursor = await db.execute("SELECT COALESCE(MAX(entry_id), 0) FROM ledger")
+        first_entry = (await cursor.fetchone())[0]
+        cursor = await db.execute("SELECT COALESCE(MAX(question_id), 0) FROM questions")
+        first_question = (await cursor.fetchone())[0]
+
+    rows = load_score_rows(args.csv)
+    match_ids = [f"load-test-{m}" for m in range(args.matches)]
+    for match_id in match_ids:
+        bot_module.MATCHES[match_id] = {"match_id": match_id, "channels": []}
+
+    lag_samples = []
+    monitor = LoopLagMonitor(lag_samples.append, interval=0.01)
+    monitor.start()
+    bot_module.automatic_create_question.start(bot_module.bot)
+    done = asyncio.Event()
+    workers = [
+        asyncio.create_task(trader(bot_module, timings, ctx, args.think, done, random.Random(rng.random())))
+        for ctx in traders
+    ]
+    started = time.perf_counter()
+    await asyncio.gather(*(replay(bot_module, m, rows, args.over_seconds, args.speed) for m in match_ids))
+    await asyncio.sleep(args.tail)
+    done.set()
+    await asyncio.gather(*workers)
+    await bot_module.trade_queue.stop()  # drains trades still in flight
+    elapsed = time.perf_counter() - started
+    bot_module.automatic_create_question.cancel()
+
+    # Settle everything the run opened, the way an admin would
+    for admin in admins:
+        for question_id in open_markets(bot_module, admin.guild.id):
+            await timings.run("resolve", bot_module.resolve.callback, admin, question_id, rng.choice((1, 2)))
+    await monitor.stop()
+    drain_started = time.perf_counter()
+    drained = await drain_outbound(bot_module, args.drain)
+    drain_time = time.perf_counter() - drain_started
+
+    async with database.reader() as db:
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM ledger WHERE entry_id > ? AND kind IN ('buy', 'sell')",
+            (first_entry,)
+        )
+        fills = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM questions WHERE question_id > ? AND auto_generated",
+            (first_question,)
+        )
+        auto_markets = (await cursor.fetchone())[0]
+        cursor = await db.execute(
+            "SELECT COUNT(*) FROM questions WHERE question_id > ? AND auto_generated AND message_id IS NULL",
+            (first_question,)
+        )
+        unposted = (await cursor.fetchone())[0]
+    dispatched = bot_module.dispatcher.stats()
+    cache = bot_module.view_cache
+    await bot_module.stop_services()
+
+    print(f"\n=== LOAD TEST: {args.traders} traders, {args.guilds} guilds, "
+          f"{args.matches} matches at {args.speed:g}x, {elapsed:.1f}s ===")
+    print(f"{'command':<16}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for name, samples in sorted(timings.samples.items()):
+        print(f"{name:<16}{len(samples):>8}{percentile(samples, 50) * 1000:>10.1f}"
+              f"{percentile(samples, 99) * 1000:>10.1f}{max(samples) * 1000:>10.1f}")
+    print(f"\nFilled trades: {fills} ({fills / elapsed:.1f}/s)")
+    expected = expected_markets(rows) * args.matches * args.guilds
+    print(f"Auto markets opened: {auto_markets} of {expected}, {unposted} never posted")
+    waits = database.write_waits
+    print(f"Writer lock: {waits} acquisitions, "
+          f"avg wait {database.write_wait_time / max(waits, 1) * 1000:.2f} ms, "
+          f"max wait {database.max_write_wait * 1000:.1f} ms")
+    print(f"Event-loop lag: p50 {percentile(lag_samples, 50) * 1000:.1f} ms, "
+          f"p99 {percentile(lag_samples, 99) * 1000:.1f} ms, "
+          f"max {max(lag_samples, default=0) * 1000:.1f} ms")
+    print(f"Outbound: {dispatched['sent']} sent, {dispatched['merged']} merged, "
+          f"{dispatched['queued']} still queued after {drain_time:.1f}s, {dispatched['dropped']} dropped, "
+          f"avg wait {dispatched['avg_wait']:.2f}s")
+    print(f"View cache: {cache.hits} hits, {cache.misses} misses")
+
+    failures = []
+    if auto_markets < expected:
+        failures.append(f"{expected - auto_markets} auto market(s) never opened")
+    if unposted:
+        failures.append(f"{unposted} auto market(s) never posted")
+    if not drained:
+        failures.append(f"outbound queue not drained within {args.drain:g}s")
+    try:
+        bot_module.watchdog.check()
+    except BlockedLoop as e:
+        failures.append(str(e))
+    for failure in failures:
+        print(f"\nFAILED: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a score stream against the bot with simulated traders")
+    parser.add_argument("--csv", default=os.path.join(HERE, "live_score_clean.csv"), help="recorded score stream")
+    parser.add_argument("--db", default=os.path.join(HERE, "market.db"), help="database to copy (never modified)")
+    parser.add_argument("--speed", type=float, default=100.0, help="replay speed, 1 to 1000")
+    parser.add_argument("--over-seconds", type=float, default=240.0, help="real length of one over")
+    parser.add_argument("--traders", type=int, default=50)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--matches", type=int, default=1, help="copies of the stream replayed at once")
+    parser.add_argument("--think", type=float, default=0.5, help="mean seconds between a trader's commands")
+    parser.add_argument("--slash", type=float, default=0.5, help="share of traders using slash commands")
+    parser.add_argument("--coins", type=float, default=1000.0, help="coins granted to each trader")
+    parser.add_argument("--tail", type=float, default=2.0, help="seconds to keep trading after the replay")
+    parser.add_argument("--drain", type=float, default=240.0, help="seconds to wait for the outbound queue to empty")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--strict-ms", type=float, default=0, help="fail if the loop is blocked this long")
+    args = parser.parse_args()
+    args.csv = os.path.abspath(args.csv)
+
+    # The bot opens market.db in its working directory, so give it a scratch one
+    workdir = tempfile.mkdtemp(prefix="sattebaaz-load-")
+    if os.path.exists(args.db):
+        copy_database(args.db, os.path.join(workdir, "market.db"))
+    os.chdir(workdir)
+    # A copy of an old single-guild database needs somewhere to put its rows
+    os.environ.setdefault("LEGACY_GUILD_ID", str(LOAD_TEST_GUILD_BASE - 1))
+    sys.path.insert(0, HERE)
+    print(f"Working in {workdir}")
+    if not asyncio.run(run(args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import json
+import os
+
+# Optional override: a JSON list of match entries in the same shape as DEFAULT_MATCHES
+MATCHES_FILE = "matches.json"
+
+DEFAULT_MATCHES = [
+    {
+        "match_id": "csk-vs-mi-38",
+        "name": "CSK vs MI",  # shown in market questions
+        "url": "https://crex.com/scoreboard/T3V/1PD/38th-Match/F/G/csk-vs-mi-38th-match-indian-premier-league-2025/live",
+        "csv": "live_score_clean.csv",
+        "channels": [],  # extra channels for auto markets; servers pick theirs with !configure
+    },
+]
+
+
+def load_matches(path=MATCHES_FILE):
+    """
+    Matches followed by the scraper and the bot.
+    Each entry has match_id, name, url, csv (score stream path), channels and
+    min_interval (fastest allowed poll for that match, in seconds).
+    """
+    if os.path.exists(path):
+        with open(path) as f:
+            entries = json.load(f)
+    else:
+        entries = DEFAULT_MATCHES
+
+    matches = []
+    for entry in entries:
+        match = dict(entry)
+        match.setdefault("name", match["match_id"])
+        match.setdefault("csv", f"live_score_{match['match_id']}.csv")
+        match.setdefault("channels", [])
+        match.setdefault("min_interval", 1.0)
+        matches.append(match)
+    return matches
@@ -0,0 +1,212 @@
+import asyncio
+import logging
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+
+# Upper bounds in seconds; one more bucket catches everything slower
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_DISABLED_TIMER = nullcontext()
+
+
+class Histogram:
+    __slots__ = ("bounds", "counts", "total", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    """
+    Counters, gauges and latency histograms, exposed in the Prometheus text
+    format. When disabled every call returns at once, so instrumented hot
+    paths cost one attribute check. Collectors are called only when the
+    metrics are read, to export numbers other objects already keep.
+    """
+
+    def __init__(self, enabled=False, prefix="sattebaaz"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self.port = None  # where serve() should listen, if anywhere
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> Histogram
+        self._collectors = []  # () -> iterable of (name, labels dict, value)
+        self._runner = None
+
+    @classmethod
+    def from_env(cls, port_variable="METRICS_PORT"):
+        """Enabled when port_variable names a port, or METRICS=1 for !stats only"""
+        port = os.getenv(port_variable)
+        metrics = cls(enabled=bool(port) or os.getenv("METRICS", "0") == "1")
+        if port:
+            metrics.port = int(port)
+        return metrics
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        if not self.enabled:
+            return
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def timer(self, name, **labels):
+        """Context manager observing the seconds its body takes"""
+        if not self.enabled:
+            return _DISABLED_TIMER
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name, labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def add_collector(self, collect):
+        self._collectors.append(collect)
+
+    def collected(self):
+        """Gauges reported by the collectors right now"""
+        samples = {}
+        for collect in self._collectors:
+            for name, labels, value in collect():
+                samples[(name, tuple(sorted(labels.items())))] = value
+        return samples
+
+    def render(self):
+        """Everything in the Prometheus text exposition format"""
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {self.prefix}_{name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, "counter")
+            lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+        gauges = dict(self.gauges)
+        gauges.update(self.collected())
+        for (name, labels), value in sorted(gauges.items()):
+            # Collected running totals are still counters
+            header(name, "counter" if name.endswith("_total") else "gauge")
+            lines.append(f"{self.prefix}_{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                lines.append(f"{self.prefix}_{name}_bucket{_labels(labels, le=bound)} {cumulative}")
+            lines.append(f"{self.prefix}_{name}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+            lines.append(f"{self.prefix}_{name}_sum{_labels(labels)} {histogram.total}")
+            lines.append(f"{self.prefix}_{name}_count{_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, port, host="127.0.0.1"):
+        """Expose render() at http://host:port/metrics"""
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        print(f"Metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+class LoopLagMonitor:
+    """Reports how late the event loop wakes a sleeper that asked for `interval`"""
+
+    def __init__(self, on_lag, interval=0.5):
+        self.on_lag = on_lag  # (seconds late) -> None
+        self.interval = interval
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.on_lag(max(0.0, time.perf_counter() - started - self.interval))
+
+
+class RateLimitLog(logging.Handler):
+    """Counts discord.py's 'being rate limited' warnings and the time it sleeps for them"""
+
+    def __init__(self, metrics):
+        super().__init__(logging.WARNING)
+        self.metrics = metrics
+
+    def emit(self, record):
+        if "rate limited" not in str(record.msg):
+            return
+        self.metrics.inc("discord_rate_limited_total")
+        retry_after = record.args[-1] if isinstance(record.args, tuple) and record.args else None
+        if isinstance(retry_after, (int, float)):
+            self.metrics.inc("discord_rate_limit_sleep_seconds_total", retry_after)
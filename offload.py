@@ -0,0 +1,136 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Offloader:
+    """
+    Runs blocking or CPU-heavy calls on a small thread pool so the event
+    loop keeps serving heartbeats and commands.
+    At most `max_pending` calls are queued or running; callers beyond that
+    wait their turn instead of piling work onto the pool.
+    """
+
+    def __init__(self, workers=4, max_pending=32, metrics=None):
+        self.workers = workers
+        self.metrics = metrics
+        self._executor = None  # created on first use, so stop() can be followed by more work
+        self._slots = asyncio.Semaphore(max_pending)
+
+    async def run(self, fn, *args, label=None):
+        """await fn(*args) on the pool"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="offload")
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+            finally:
+                if self.metrics is not None:
+                    self.metrics.observe(
+                        "offload_seconds", time.perf_counter() - started,
+                        task=label or getattr(fn, "__name__", "call")
+                    )
+
+    async def stop(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class BlockedLoop(Exception):
+    pass
+
+
+class BlockingWatchdog:
+    """
+    Spots the event loop being held by one step for longer than `threshold`
+    seconds and logs what was running at the time.
+    A task on the loop ticks every `interval`; a watcher thread notices when
+    the ticks stop and grabs the loop thread's stack, which names the
+    coroutine and the call that is blocking. In strict mode every stall is
+    also kept in `violations`, and check() raises if there were any.
+    """
+
+    def __init__(self, threshold=0.25, interval=0.05, strict=False, metrics=None):
+        self.threshold = threshold
+        self.interval = interval
+        self.strict = strict
+        self.metrics = metrics
+        self.violations = []  # (seconds blocked, stack) in strict mode
+        self._last_tick = time.monotonic()
+        self._stack = None  # loop thread's stack during the current stall
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._stopping.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._thread.join()
+
+    def check(self):
+        """Raise BlockedLoop if anything blocked the loop (strict mode)"""
+        if self.violations:
+            blocked, stack = max(self.violations, key=lambda v: v[0])
+            raise BlockedLoop(
+                f"{len(self.violations)} step(s) blocked the event loop; "
+                f"worst was {blocked * 1000:.0f} ms in:\n{stack}"
+            )
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_tick = now
+            blocked = now - expected
+            stack, self._stack = self._stack, None
+            if blocked > self.threshold:
+                stack = stack or "(finished before it could be captured)\n"
+                print(f"Event loop blocked for {blocked * 1000:.0f} ms in:\n{stack}")
+                if self.metrics is not None:
+                    self.metrics.inc("event_loop_stalls_total")
+                if self.strict:
+                    self.violations.append((blocked, stack))
+
+    def _watch(self):
+        # Poll often enough to catch a stall while it is still happening
+        while not self._stopping.wait(self.threshold / 4):
+            stalled = time.monotonic() - self._last_tick > self.interval + self.threshold / 2
+            if stalled and self._stack is None:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._stack = _task_stack(frame)
+
+
+def _task_stack(frame):
+    """Formatted stack of the running step, without the event loop's own frames"""
+    frames = traceback.extract_stack(frame)
+    start = 0
+    for i, entry in enumerate(frames):
+        if os.path.basename(entry.filename) == "events.py" and "asyncio" in entry.filename:
+            start = i + 1  # Handle._run: everything after it is the step itself
+    return "".join(traceback.format_list(frames[start:]))
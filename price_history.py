@@ -0,0 +1,174 @@
+import asyncio
+import io
+import time
+from array import array
+
+try:
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None  # !history falls back to a text chart
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+
+
+class PriceSeries:
+    """One market's price path as parallel array columns"""
+    __slots__ = ("times", "price1", "price2")
+
+    def __init__(self):
+        self.times = array("d")  # epoch seconds
+        self.price1 = array("d")
+        self.price2 = array("d")
+
+    def append(self, t, prices):
+        self.times.append(t)
+        self.price1.append(prices[0])
+        self.price2.append(prices[1])
+
+    def extend(self, other):
+        self.times.extend(other.times)
+        self.price1.extend(other.price1)
+        self.price2.extend(other.price2)
+
+    def __len__(self):
+        return len(self.times)
+
+    def downsample(self, points):
+        """At most `points` ticks, keeping the last tick of each bucket"""
+        n = len(self.times)
+        if n <= points:
+            return self
+        out = PriceSeries()
+        for b in range(points):
+            i = min(n - 1, (b + 1) * n // points - 1)
+            out.append(self.times[i], (self.price1[i], self.price2[i]))
+        return out
+
+
+class PriceHistory:
+    """
+    Append-only price ticks for every market.
+    Ticks of open markets are kept in memory and written to price_ticks in
+    batches every flush_interval seconds; closed markets are read back from
+    disk when asked for. A market still open from before a restart gets its
+    earlier ticks from disk the first time it is read.
+    """
+
+    def __init__(self, database, flush_interval=5.0):
+        self.database = database
+        self.flush_interval = flush_interval
+        self.series = {}  # question_id -> PriceSeries of open markets
+        self._seeded = set()  # question_ids whose series includes the ticks on disk
+        self._closed = set()  # forgotten, but ticks not yet on disk
+        self._pending = []  # (question_id, ts ms, price1, price2) not yet on disk
+        self._task = None
+
+    def record(self, question_id, prices, t=None):
+        t = time.time() if t is None else t
+        self.series.setdefault(question_id, PriceSeries()).append(t, prices)
+        self._pending.append((question_id, int(t * 1000), prices[0], prices[1]))
+
+    def forget(self, question_id):
+        """Drop a closed market from memory once its ticks are on disk"""
+        self._closed.add(question_id)
+
+    async def get(self, question_id):
+        series = self.series.get(question_id)
+        if series is None:
+            return await self._load(question_id)
+        if question_id in self._seeded:
+            return series
+        # Ticks from before this run are on disk, all older than the first one in memory
+        merged = await self._load(question_id, before=series.times[0])
+        merged.extend(series)
+        if self.series.get(question_id) is series:
+            self.series[question_id] = merged
+            self._seeded.add(question_id)
+        return merged
+
+    async def _load(self, question_id, before=None):
+        query = "SELECT ts, price1, price2 FROM price_ticks WHERE question_id = ?"
+        params = [question_id]
+        if before is not None:
+            query += " AND ts < ?"
+            params.append(int(before * 1000))
+        async with self.database.reader() as db:
+            cursor = await db.execute(query + " ORDER BY ts", params)
+            rows = await cursor.fetchall()
+        series = PriceSeries()
+        for ts, p1, p2 in rows:
+            series.append(ts / 1000, (p1, p2))
+        return series
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if self._pending:
+            rows, self._pending = self._pending, []
+            try:
+                async with self.database.writer() as db:
+                    await db.executemany(
+                        "INSERT INTO price_ticks (question_id, ts, price1, price2) VALUES (?,?,?,?)",
+                        rows
+                    )
+                    await db.commit()
+            except Exception as e:
+                self._pending = rows + self._pending  # retry on the next flush
+                print(f"Error writing price ticks: {str(e)}")
+                return
+        # Closed markets leave memory once nothing of theirs is waiting to be written
+        waiting = {row[0] for row in self._pending}
+        for question_id in self._closed - waiting:
+            self.series.pop(question_id, None)
+            self._seeded.discard(question_id)
+        self._closed &= waiting
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+def render_chart(series, title, labels=("Option 1", "Option 2")):
+    """PNG bytes of the price path, or None without matplotlib"""
+    if plt is None:
+        return None
+    from datetime import datetime
+    times = [datetime.fromtimestamp(t) for t in series.times]
+    fig, ax = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        ax.plot(times, series.price1, label=labels[0], color="#2ecc71", drawstyle="steps-post")
+        ax.plot(times, series.price2, label=labels[1], color="#e74c3c", drawstyle="steps-post")
+        ax.set_title(title)
+        ax.set_ylabel("Price (coins)")
+        ax.legend()
+        ax.grid(alpha=0.3)
+        fig.autofmt_xdate()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+def sparkline(values):
+    """One-line text chart of values"""
+    if not values:
+        return ""
+    low, high = min(values), max(values)
+    span = (high - low) or 1.0
+    return "".join(SPARK_CHARS[int((v - low) / span * (len(SPARK_CHARS) - 1))] for v in values)
@@ -0,0 +1,105 @@
+import math
+
+import numpy as np
+
+# A winning LMSR share pays this many coins; prices are PAYOUT * probability
+LMSR_PAYOUT = 10.0
+DEFAULT_LIQUIDITY = 25.0
+
+
+def update_price(old_price, quantity, drastic_factor=0.01):
+    """
+    Update the price of an option.
+    Use positive quantity for buy, negative for sell.
+    The drastic_factor controls how dramatic the change is.
+    """
+    return max(0.01, old_price * math.exp(drastic_factor * quantity))
+
+
+def update_prices(price1, price2, quantity, bought_option):
+    """
+    Update prices for both options when shares are bought/sold
+    - quantity: positive for buy, negative for sell
+    - bought_option: 1 or 2
+    Returns: (new_price1, new_price2)
+    """
+    drastic_factor = 0.01  # 1% change per share instead of 0.1%
+
+    if bought_option == 1:
+        new_price1 = price1 * math.exp(drastic_factor * quantity)
+        new_price2 = price2 * math.exp(-drastic_factor * quantity)
+    else:
+        new_price1 = price1 * math.exp(-drastic_factor * quantity)
+        new_price2 = price2 * math.exp(drastic_factor * quantity)
+
+    # Enforce minimum price of 0.5 for both options
+    return max(0.5, new_price1), max(0.5, new_price2)
+
+
+class ExponentialPricing:
+    """Original multiplicative model: the whole order fills at the pre-trade price"""
+    mode = "exp"
+
+    def fill(self, prices, option, quantity):
+        """Returns: (average fill price, new_prices)"""
+        price1, price2 = prices
+        fill_price = prices[option - 1]
+        if quantity > 0:
+            return fill_price, update_prices(price1, price2, quantity, option)
+        new_price = update_price(fill_price, quantity)
+        return fill_price, ((new_price, price2) if option == 1 else (price1, new_price))
+
+    def quote(self, prices, option, sizes):
+        """Total cost of each candidate size (negative sizes are sells)"""
+        return np.asarray(sizes, dtype=float) * prices[option - 1]
+
+
+class LMSRPricing:
+    """
+    Logarithmic market scoring rule for a two-outcome market.
+    Cost function C(q) = b * ln(e^(q1/b) + e^(q2/b)), scaled by LMSR_PAYOUT.
+    With only two outcomes the cost of trading d shares of option i is
+    b * ln(1 - p_i + p_i * e^(d/b)), so fills need no outstanding-share state.
+    The market maker's worst-case loss is bounded by b * ln(2) * LMSR_PAYOUT.
+    """
+    mode = "lmsr"
+
+    def __init__(self, liquidity=DEFAULT_LIQUIDITY):
+        if liquidity <= 0:
+            raise ValueError("liquidity must be positive")
+        self.b = float(liquidity)
+
+    def _log_growth(self, p, x):
+        # ln(1 - p + p * e^x) without overflow for large |x|
+        return np.logaddexp(np.log1p(-p), np.log(p) + x)
+
+    def fill(self, prices, option, quantity):
+        """Returns: (average fill price, new_prices)"""
+        p = self._probability(prices, option)
+        x = quantity / self.b
+        log_growth = float(self._log_growth(p, x))
+        cost = LMSR_PAYOUT * self.b * log_growth
+        new_p = math.exp(math.log(p) + x - log_growth)
+        new_p = min(max(new_p, 1e-12), 1 - 1e-12)
+        new_price = LMSR_PAYOUT * new_p
+        other = LMSR_PAYOUT - new_price
+        new_prices = (new_price, other) if option == 1 else (other, new_price)
+        return cost / quantity, new_prices
+
+    def quote(self, prices, option, sizes):
+        """Total cost of each candidate size in one vectorized pass"""
+        p = self._probability(prices, option)
+        x = np.asarray(sizes, dtype=float) / self.b
+        return LMSR_PAYOUT * self.b * self._log_growth(p, x)
+
+    def _probability(self, prices, option):
+        # Renormalize in case stored prices drifted from summing to the payout
+        p = prices[option - 1] / (prices[0] + prices[1])
+        return min(max(p, 1e-12), 1 - 1e-12)
+
+
+def pricing_for(mode, liquidity=None):
+    """Build the pricing model stored on a question row"""
+    if mode == "lmsr":
+        return LMSRPricing(liquidity or DEFAULT_LIQUIDITY)
+    return ExponentialPricing()
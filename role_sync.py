@@ -0,0 +1,97 @@
+import asyncio
+import discord
+
+
+class RoleSync:
+    """
+    Keeps members' rank-tier roles in line with their correct predictions.
+    Tier roles are resolved once per guild and cached. Members who already
+    hold exactly their target tier are skipped; the rest are updated with at
+    most `concurrency` Discord requests in flight.
+    """
+
+    def __init__(self, tiers, concurrency=8):
+        self.tiers = tiers  # ascending by threshold, like ROLE_TIERS
+        self.tier_names = {t["name"] for t in tiers}
+        self._roles = {}  # guild id -> {tier name: Role}
+        self._creating = {}  # guild id -> lock around role creation
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    def tier_for(self, correct_count):
+        return next((t for t in reversed(self.tiers) if correct_count >= t["threshold"]), None)
+
+    def forget(self, guild_id):
+        """Drop a guild's cached roles, e.g. after one was deleted"""
+        self._roles.pop(guild_id, None)
+
+    async def sync(self, guild, counts):
+        """
+        Bring each member's tier role up to date.
+        counts: {user_id: correct predictions}
+        Returns: number of members whose roles were changed
+        """
+        results = await asyncio.gather(
+            *(self._sync_member(guild, user_id, count) for user_id, count in counts.items())
+        )
+        return sum(results)
+
+    async def _sync_member(self, guild, user_id, correct_count):
+        tier = self.tier_for(correct_count)
+        if not tier:
+            return False
+        role = await self._tier_role(guild, tier)
+        if role is None:
+            return False
+
+        async with self._semaphore:
+            try:
+                member = guild.get_member(user_id) or await guild.fetch_member(user_id)
+                stale = [r for r in member.roles if r.name in self.tier_names and r != role]
+                if role in member.roles and not stale:
+                    return False  # tier unchanged
+                if stale:
+                    await member.remove_roles(*stale, reason="Prediction rank update")
+                if role not in member.roles:
+                    await member.add_roles(role, reason="Prediction rank update")
+                return True
+            except discord.NotFound:
+                return False  # left the guild
+            except discord.HTTPException as e:
+                print(f"Error updating roles for {user_id}: {str(e)}")
+                return False
+
+    async def _tier_role(self, guild, tier):
+        roles = self._roles.setdefault(guild.id, {})
+        role = roles.get(tier["name"])
+        if role is None:
+            lock = self._creating.setdefault(guild.id, asyncio.Lock())
+            async with lock:
+                role = roles.get(tier["name"])  # another member may have created it
+                if role is None:
+                    role = await self._find_or_create(guild, tier)
+                    if role is None:
+                        return None
+                    roles[tier["name"]] = role
+
+        # Check role position
+        if role.position >= guild.me.top_role.position:
+            print(f"Bot cannot assign higher role: {role.name}")
+            return None
+        return role
+
+    async def _find_or_create(self, guild, tier):
+        role = discord.utils.get(guild.roles, name=tier["name"])
+        if role:
+            return role
+        try:
+            role = await guild.create_role(
+                name=tier["name"],
+                color=tier["color"],
+                reason="Auto-created prediction tier role",
+            )
+            # Move the role just below the bot's top role
+            await role.edit(position=guild.me.top_role.position - 1)
+            return role
+        except discord.Forbidden:
+            print(f"Missing permissions to create role: {tier['name']}")
+            return None
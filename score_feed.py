@@ -0,0 +1,168 @@
+import asyncio
+import csv
+import os
+import socket
+import time
+
+from scores import next_innings, overs_to_balls
+
+SOCKET_PATH = "score_feed.sock"
+
+
+def parse_row(fields):
+    """
+    CSV fields [score, overs, innings] -> event dict, or None for headers/partial rows.
+    Older streams have no innings column; their rows get innings None (see infer_innings).
+    """
+    if len(fields) < 2 or not fields[1]:
+        return None
+    try:
+        innings = int(fields[2]) if len(fields) > 2 and fields[2] else None
+        return {"score": fields[0], "overs": float(fields[1]), "innings": innings}
+    except ValueError:
+        return None
+
+
+def infer_innings(events, previous=None):
+    """
+    Fill in the innings of rows without one, as BallLog does: the overs
+    falling back by more than an over starts the next innings.
+    `previous` is (innings, balls) of the row before events; returns it for the last one.
+    """
+    for event in events:
+        balls = overs_to_balls(f"{event['overs']:.1f}")
+        if event["innings"] is None:
+            if previous is None:
+                event["innings"] = 1
+            elif balls is None:
+                event["innings"] = previous[0]
+            else:
+                event["innings"] = next_innings(previous[0], previous[1], balls)
+        if balls is not None:
+            previous = (event["innings"], balls)
+    return previous
+
+
+class ScoreFeed:
+    """
+    Delivers new score rows to the bot as they are appended.
+    Every match has its own CSV stream written by API.py; those stay the
+    durable, append-only log. The feed tails each one by byte offset and only
+    ever consumes complete lines. The scraper pokes a local Unix socket with
+    the match id after each append so new rows arrive immediately; a slow
+    poll covers scrapers that can't reach the socket. When the scraper runs
+    in-process, publish() skips the file entirely. File reads run through
+    `offload` (asyncio.to_thread by default) so a long stream never blocks
+    the loop.
+    Events are dicts with match_id, score, overs, innings and received (epoch
+    seconds the bot got the row).
+    """
+
+    def __init__(self, streams, socket_path=SOCKET_PATH, poll_interval=5.0, offload=None):
+        self.streams = dict(streams)  # match_id -> csv path
+        self.offload = offload or asyncio.to_thread  # async (fn, *args) -> result
+        self.socket_path = socket_path
+        self.poll_interval = poll_interval
+        self.queue = asyncio.Queue()
+        self._offsets = {match_id: 0 for match_id in self.streams}
+        self._previous = {}  # match_id -> (innings, balls) of the last row read
+        self._pending = set()  # streams the scraper said have grown
+        self._wake = asyncio.Event()
+        self._server = None
+        self._task = None
+
+    async def start(self):
+        # Replay only the latest row of each stream so consumers can initialize
+        for match_id in self.streams:
+            rows = await self.offload(self._read_new_rows, match_id)
+            if rows:
+                self.queue.put_nowait(rows[-1])
+
+        if self.socket_path and hasattr(asyncio, "start_unix_server"):
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+            self._server = await asyncio.start_unix_server(self._on_client, path=self.socket_path)
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def publish(self, event):
+        """In-process producers hand events over directly"""
+        event.setdefault("received", time.time())
+        self.queue.put_nowait(event)
+
+    async def get(self):
+        return await self.queue.get()
+
+    async def _on_client(self, reader, writer):
+        # Each line from the scraper names a match whose stream grew
+        try:
+            while line := await reader.readline():
+                match_id = line.decode("utf-8", errors="replace").strip()
+                if match_id in self.streams:
+                    self._pending.add(match_id)
+                self._wake.set()
+        finally:
+            writer.close()
+
+    async def _tail(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_interval)
+                self._wake.clear()
+                due, self._pending = self._pending, set()
+            except asyncio.TimeoutError:
+                due = set(self.streams)  # periodic sweep of every stream
+            for match_id in due:
+                try:
+                    for event in await self.offload(self._read_new_rows, match_id):
+                        self.queue.put_nowait(event)
+                except OSError as e:
+                    print(f"Error reading score feed for {match_id}: {str(e)}")
+
+    def _read_new_rows(self, match_id):
+        path = self.streams[match_id]
+        if not os.path.exists(path):
+            return []
+        offset = self._offsets[match_id]
+        if os.path.getsize(path) < offset:
+            offset = 0  # file was truncated or replaced
+            self._previous.pop(match_id, None)
+        with open(path, "rb") as f:
+            f.seek(offset)
+            chunk = f.read()
+        # Stop at the last newline so a half-written row is left for next time
+        end = chunk.rfind(b"\n") + 1
+        self._offsets[match_id] = offset + end
+        if end == 0:
+            return []
+        lines = chunk[:end].decode("utf-8", errors="replace").splitlines()
+        events = [e for e in (parse_row(row) for row in csv.reader(lines)) if e]
+        self._previous[match_id] = infer_innings(events, self._previous.get(match_id))
+        received = time.time()
+        for event in events:
+            event["match_id"] = match_id
+            event["received"] = received
+        return events
+
+
+def notify(match_id, socket_path=SOCKET_PATH):
+    """Called by the scraper after appending a row to match_id's stream; never raises"""
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.settimeout(0.5)
+            s.connect(socket_path)
+            s.sendall(f"{match_id}\n".encode("utf-8"))
+    except OSError:
+        pass  # bot not listening; it will pick the row up on its next poll
@@ -0,0 +1,150 @@
+import re
+import time
+from collections import deque
+
+BALLS_PER_OVER = 6
+MAX_WICKETS = 10
+
+# "185-10 (20.0)" or "70/3 10.2 ov": runs, wickets and overs apart
+SPACED_PATTERN = re.compile(r"(\d{1,3})\s*[-/]\s*(\d{1,2})[\s(]+(\d{1,2}(?:\.\d)?)\b")
+# "70-310.2", as the scraper sees it once whitespace is stripped: the wickets
+# run straight into the overs, so the digits after the dash are split below
+GLUED_PATTERN = re.compile(r"(\d{1,3})[-/](\d{2,4}\.\d)")
+OVERS_PATTERN = re.compile(r"(0|[1-9]\d?)(?:\.([0-5]))?")
+
+
+class ScoreEvent:
+    """One scoreboard state: the innings total after `balls` legal deliveries"""
+    __slots__ = ("runs", "wickets", "balls", "innings", "timestamp")
+
+    def __init__(self, runs, wickets, balls, innings=1, timestamp=None):
+        self.runs = runs
+        self.wickets = wickets
+        self.balls = balls
+        self.innings = innings
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    @property
+    def key(self):
+        return (self.innings, self.balls)
+
+    @property
+    def overs(self):
+        """Cricket notation, e.g. '10.2' for 10 overs and 2 balls"""
+        return f"{self.balls // BALLS_PER_OVER}.{self.balls % BALLS_PER_OVER}"
+
+    @property
+    def end_of_over(self):
+        return self.balls > 0 and self.balls % BALLS_PER_OVER == 0
+
+    def row(self):
+        """The score stream's CSV row: score, overs, innings"""
+        return [f"{self.runs}-{self.wickets}", self.overs, self.innings]
+
+    def __repr__(self):
+        return f"ScoreEvent({self.runs}-{self.wickets}, {self.overs} ov, innings {self.innings})"
+
+
+def overs_to_balls(overs):
+    """'10.2' -> 62, or None if it isn't valid cricket overs notation"""
+    match = OVERS_PATTERN.fullmatch(overs)
+    if not match:
+        return None
+    return int(match.group(1)) * BALLS_PER_OVER + int(match.group(2) or 0)
+
+
+def parse_score(raw, innings=1, timestamp=None):
+    """
+    Scoreboard text -> ScoreEvent, or None when it holds no runs-wickets
+    and overs (between innings, before the toss, a changed page).
+    """
+    match = SPACED_PATTERN.search(raw)
+    if match:
+        runs, wickets, overs = match.groups()
+        splits = [(wickets, overs)]
+    else:
+        match = GLUED_PATTERN.search(raw)
+        if not match:
+            return None
+        runs, digits = match.groups()
+        # One or two digits of wickets; the other split fails to parse as overs
+        splits = [(digits[:cut], digits[cut:]) for cut in (1, 2)]
+    candidates = [
+        (int(w), overs_to_balls(o)) for w, o in splits
+        if (w == "0" or not w.startswith("0")) and int(w) <= MAX_WICKETS and overs_to_balls(o) is not None
+    ]
+    if len(candidates) != 1:
+        return None  # nothing valid, or ambiguous
+    wickets, balls = candidates[0]
+    return ScoreEvent(int(runs), wickets, balls, innings, timestamp)
+
+
+def next_innings(innings, previous_balls, balls):
+    """Innings of a state `balls` deep that follows one `previous_balls` deep in `innings`"""
+    # The count falling back by more than an over means the chase has begun;
+    # a page a ball or two stale does not
+    return innings + 1 if previous_balls - balls > BALLS_PER_OVER else innings
+
+
+class BallLog:
+    """
+    The most recent `size` scoreboard states of one match, one per
+    (innings, ball), in memory.
+    Repeated polls of the same ball update that entry in place (wides and
+    no-balls add runs without a legal delivery); anything older than the
+    latest ball is dropped. A new innings is detected when the ball count
+    falls back by more than an over; a page a ball or two stale is ignored.
+    """
+
+    def __init__(self, size=240):
+        self.balls = deque(maxlen=size)
+
+    @property
+    def latest(self):
+        return self.balls[-1] if self.balls else None
+
+    @property
+    def innings(self):
+        return self.latest.innings if self.balls else 1
+
+    def add(self, event):
+        """
+        Store a parsed event (its innings is set here).
+        Returns: True for a new ball, False for a repeat or a stale state
+        """
+        latest = self.latest
+        if latest is None:
+            self.balls.append(event)
+            return True
+        event.innings = next_innings(latest.innings, latest.balls, event.balls)
+        if event.key == latest.key:
+            if (event.runs, event.wickets) != (latest.runs, latest.wickets):
+                self.balls[-1] = event
+            return False
+        if event.key < latest.key:
+            return False  # an older page from a lagging cache
+        self.balls.append(event)
+        return True
+
+    def recent(self, balls):
+        """States of the current innings within the last `balls` deliveries"""
+        latest = self.latest
+        if latest is None:
+            return []
+        return [e for e in self.balls if e.innings == latest.innings and e.balls >= latest.balls - balls]
+
+    def runs_in_last(self, balls):
+        window = self.recent(balls)
+        return window[-1].runs - window[0].runs if len(window) > 1 else 0
+
+    def run_rate(self, balls=None):
+        """Runs per over in the current innings, or over its last `balls` deliveries"""
+        latest = self.latest
+        if latest is None or latest.balls == 0:
+            return 0.0
+        if balls is None:
+            return latest.runs * BALLS_PER_OVER / latest.balls
+        window = self.recent(balls)
+        if len(window) < 2 or window[-1].balls == window[0].balls:
+            return 0.0
+        return (window[-1].runs - window[0].runs) * BALLS_PER_OVER / (window[-1].balls - window[0].balls)
@@ -0,0 +1,125 @@
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Lines API.py prints to report it is alive; everything else is log output
+HEARTBEAT_PREFIX = "HEARTBEAT "
+# API.py exits with this when another scraper already holds the lock
+EXIT_ALREADY_RUNNING = 3
+
+SCRAPER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "API.py")
+
+
+class ScraperSupervisor:
+    """
+    Runs API.py as a child process and keeps it running.
+    The scraper prints a heartbeat every few seconds; if none arrives for
+    `heartbeat_timeout` seconds it is killed and restarted. Restarts back
+    off exponentially from `backoff` up to `max_backoff`, and the backoff
+    resets once a run has stayed up for `healthy_after` seconds. The
+    scraper's output is relayed with a [scraper] prefix.
+    """
+
+    def __init__(self, script=SCRAPER_SCRIPT, heartbeat_timeout=45.0, backoff=1.0,
+                 max_backoff=300.0, healthy_after=60.0, stop_timeout=5.0):
+        self.command = [sys.executable, "-u", script]
+        self.heartbeat_timeout = heartbeat_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.healthy_after = healthy_after
+        self.stop_timeout = stop_timeout
+        self.restarts = 0
+        self.last_heartbeat = None  # monotonic time of the last heartbeat
+        self.matches = {}  # match id -> status from the last heartbeat
+        self._process = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.returncode is None
+
+    def heartbeat_age(self):
+        return None if self.last_heartbeat is None else time.monotonic() - self.last_heartbeat
+
+    def start(self):
+        """Launch the scraper in the background; returns immediately"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self._terminate()
+
+    async def _run(self):
+        delay = self.backoff
+        while True:
+            started = time.monotonic()
+            try:
+                code = await self._run_once()
+            except Exception as e:
+                # Anything else (a failed spawn, an over-long output line) must not end supervision
+                code = None
+                print(f"Error running scraper: {str(e)}")
+
+            if code == EXIT_ALREADY_RUNNING:
+                print(f"Another scraper is already running; checking again in {self.max_backoff:.0f}s")
+                await asyncio.sleep(self.max_backoff)
+                continue
+            if time.monotonic() - started >= self.healthy_after:
+                delay = self.backoff
+            print(f"Scraper stopped (exit code {code}); restarting in {delay:g}s")
+            await asyncio.sleep(delay)
+            delay = min(self.max_backoff, delay * 2)
+            self.restarts += 1
+
+    async def _run_once(self):
+        """Run one scraper process until it exits or goes quiet; returns its exit code"""
+        self._process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+        self.last_heartbeat = time.monotonic()
+        try:
+            while True:
+                timeout = self.heartbeat_timeout - (time.monotonic() - self.last_heartbeat)
+                try:
+                    line = await asyncio.wait_for(self._process.stdout.readline(), max(timeout, 0))
+                except asyncio.TimeoutError:
+                    print(f"No scraper heartbeat for {self.heartbeat_timeout:.0f}s; restarting it")
+                    break
+                if not line:
+                    break  # process exited
+                self._on_line(line.decode("utf-8", errors="replace").rstrip())
+        finally:
+            await self._terminate()
+        return self._process.returncode
+
+    def _on_line(self, text):
+        if text.startswith(HEARTBEAT_PREFIX):
+            self.last_heartbeat = time.monotonic()
+            try:
+                self.matches = json.loads(text[len(HEARTBEAT_PREFIX):])
+            except ValueError:
+                pass
+            return
+        print(f"[scraper] {text}")
+
+    async def _terminate(self):
+        process = self._process
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), self.stop_timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
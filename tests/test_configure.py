@@ -0,0 +1,60 @@
+"""Both forms of !configure parse the arguments the help text advertises"""
+import asyncio
+from unittest import mock
+
+import discord
+import pytest
+from discord import app_commands
+from discord.ext import commands
+from discord.ext.commands.view import StringView
+
+import bot
+
+CHANNEL_ID = 111111111111111111
+ROLE_ID = 222222222222222222
+
+
+def prefix_context(args):
+    channel = mock.MagicMock(spec=discord.TextChannel)
+    channel.id, channel.name = CHANNEL_ID, "markets"
+    role = mock.MagicMock(spec=discord.Role)
+    role.id, role.name = ROLE_ID, "Mods"
+    guild = mock.MagicMock(spec=discord.Guild)
+    guild.id = 1
+    guild.text_channels = [channel]
+    guild.get_channel = lambda i: channel if i == CHANNEL_ID else None
+    guild.get_role = lambda i: role if i == ROLE_ID else None
+    guild._roles = {ROLE_ID: role}
+    message = mock.MagicMock(spec=discord.Message)
+    message.guild, message.channel = guild, channel
+    ctx = commands.Context(message=message, bot=bot.bot, view=StringView(args), prefix="!", command=bot.configure)
+    return ctx, channel, role
+
+
+@pytest.mark.parametrize("args, expected", [
+    ("", (False, False, None)),
+    ("all", (False, False, "all")),
+    ("none", (False, False, "none")),
+    (f"<@&{ROLE_ID}>", (False, True, None)),
+    (f"<#{CHANNEL_ID}>", (True, False, None)),
+    (f"<#{CHANNEL_ID}> <@&{ROLE_ID}> csk-vs-mi-38,rcb-vs-kkr-40",
+     (True, True, "csk-vs-mi-38,rcb-vs-kkr-40")),
+    (f"<@&{ROLE_ID}> csk-vs-mi-38", (False, True, "csk-vs-mi-38")),
+])
+def test_prefix_forms_parse(args, expected):
+    ctx, channel, role = prefix_context(args)
+    asyncio.run(bot.configure._parse_arguments(ctx))
+    parsed_channel, parsed_role = ctx.args[1:]
+    assert (parsed_channel is channel, parsed_role is role, ctx.kwargs["matches"]) == expected
+    assert parsed_channel in (channel, None) and parsed_role in (role, None)
+
+
+def test_slash_form_has_optional_channel_role_and_matches():
+    parameters = {p.name: p for p in bot.configure.app_command.parameters}
+    assert list(parameters) == ["channel", "admin_role", "matches"]
+    assert parameters["channel"].type is discord.AppCommandOptionType.channel
+    assert discord.ChannelType.text in parameters["channel"].channel_types
+    assert parameters["admin_role"].type is discord.AppCommandOptionType.role
+    assert parameters["matches"].type is discord.AppCommandOptionType.string
+    assert not any(p.required for p in parameters.values())
+    assert isinstance(bot.configure.app_command, app_commands.Command)
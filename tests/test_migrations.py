@@ -0,0 +1,46 @@
+"""run_migrations applies each step and its user_version bump atomically"""
+import asyncio
+
+import aiosqlite
+import pytest
+
+import bot
+
+
+async def user_version(db):
+    cursor = await db.execute("PRAGMA user_version")
+    return (await cursor.fetchone())[0]
+
+
+async def table_names(db):
+    cursor = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+    return {row[0] for row in await cursor.fetchall()}
+
+
+def test_fresh_database_reaches_latest_version(tmp_path):
+    async def scenario():
+        async with aiosqlite.connect(tmp_path / "market.db", isolation_level=None) as db:
+            await bot.run_migrations(db)
+            return await user_version(db), await table_names(db)
+
+    version, tables = asyncio.run(scenario())
+    assert version == len(bot.MIGRATIONS)
+    assert {"users", "questions", "holdings", "ledger", "guild_config"} <= tables
+
+
+def test_failed_step_rolls_back_to_previous_version(tmp_path, monkeypatch):
+    async def broken_step(db):
+        await db.execute("CREATE TABLE half_done (x INTEGER)")
+        raise RuntimeError("step failed")
+
+    monkeypatch.setattr(bot, "MIGRATIONS", bot.MIGRATIONS[:2] + [broken_step])
+
+    async def scenario():
+        async with aiosqlite.connect(tmp_path / "market.db", isolation_level=None) as db:
+            with pytest.raises(RuntimeError):
+                await bot.run_migrations(db)
+            return await user_version(db), await table_names(db)
+
+    version, tables = asyncio.run(scenario())
+    assert version == 2
+    assert "half_done" not in tables and "holdings" in tables
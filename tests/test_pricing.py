@@ -0,0 +1,22 @@
+"""Vectorized quotes agree with what a fill of the same size costs"""
+import pytest
+
+from pricing import ExponentialPricing, LMSRPricing
+
+SIZES = (1, 10, 50, -5)
+
+
+@pytest.mark.parametrize("pricing", [LMSRPricing(25.0), ExponentialPricing()])
+@pytest.mark.parametrize("option", [1, 2])
+def test_quote_matches_fill(pricing, option):
+    prices = (6.5, 3.5)
+    costs = pricing.quote(prices, option, SIZES)
+    for size, cost in zip(SIZES, costs):
+        fill_price, _ = pricing.fill(prices, option, size)
+        assert cost == pytest.approx(fill_price * size)
+
+
+def test_lmsr_large_orders_cost_more_per_share():
+    costs = LMSRPricing(25.0).quote((5.0, 5.0), 1, (1, 10, 50))
+    per_share = [cost / size for cost, size in zip(costs, (1, 10, 50))]
+    assert per_share == sorted(per_share) and per_share[0] < per_share[-1] < 10.0
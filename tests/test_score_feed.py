@@ -0,0 +1,44 @@
+"""ScoreFeed reads the innings of rows from streams that predate the innings column"""
+import os
+
+from score_feed import ScoreFeed, parse_row
+
+LEGACY_STREAM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "live_score_clean.csv")
+
+
+def read_rows(feed, match_id="legacy"):
+    return [(event["innings"], event["overs"]) for event in feed._read_new_rows(match_id)]
+
+
+def test_parse_row_leaves_missing_innings_unset():
+    assert parse_row(["70-3", "10.0"])["innings"] is None
+    assert parse_row(["10-0", "1.0", "2"])["innings"] == 2
+    assert parse_row(["score", "overs"]) is None
+
+
+def test_chase_in_legacy_stream_is_second_innings():
+    feed = ScoreFeed({"legacy": LEGACY_STREAM}, socket_path=None)
+    rows = read_rows(feed)
+    chase = rows.index((2, 1.0))
+    assert rows[chase - 1] == (1, 20.0)
+    assert all(innings == 2 for innings, _ in rows[chase:])
+    # (innings, over) never goes backwards, so the chase overs open markets too
+    assert all(a <= b for a, b in zip(rows, rows[1:]))
+
+
+def test_innings_carries_across_reads(tmp_path):
+    stream = tmp_path / "live_score_legacy.csv"
+    with open(LEGACY_STREAM) as f:
+        lines = f.readlines()
+    chase = next(i for i, line in enumerate(lines) if line.startswith("10-0,1.0"))
+    stream.write_text("".join(lines[:chase + 1]))
+    feed = ScoreFeed({"legacy": str(stream)}, socket_path=None)
+    assert read_rows(feed)[-1] == (2, 1.0)
+
+    with open(stream, "a") as f:
+        f.writelines(lines[chase + 1:chase + 3])
+    assert [innings for innings, _ in read_rows(feed)] == [2, 2]
+
+    # A replaced stream starts over from the first innings
+    stream.write_text("".join(lines[:3]))
+    assert [innings for innings, _ in read_rows(feed)] == [1, 1]
@@ -0,0 +1,128 @@
+"""API.py against a local stand-in for crex.com serving recorded pages"""
+import asyncio
+import csv
+import os
+import re
+
+import aiohttp
+from aiohttp import web
+from bs4 import BeautifulSoup
+
+import API
+from scores import parse_score
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def recorded_page():
+    with open(os.path.join(FIXTURES, "crex_live.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+def page_with_score(runs_wickets, overs):
+    """The recorded page with another score in the live header"""
+    return recorded_page().replace("<span>70-3</span> <span>10.2</span>", f"<span>{runs_wickets}</span> <span>{overs}</span>")
+
+
+def soup_score(html):
+    return BeautifulSoup(html, API.HTML_PARSER).select_one(API.CSS_SELECTOR).get_text(strip=True)
+
+
+class StandIn:
+    """Serves one page at /live with an ETag and answers revalidation with 304"""
+
+    def __init__(self, html, etag):
+        self.html = html
+        self.etag = etag
+        self.requests = []  # headers of every request received
+
+    async def handle(self, request):
+        self.requests.append(dict(request.headers))
+        if self.etag and request.headers.get("If-None-Match") == self.etag:
+            return web.Response(status=304, headers={"ETag": self.etag})
+        headers = {"ETag": self.etag} if self.etag else {}
+        return web.Response(text=self.html, content_type="text/html", headers=headers)
+
+    async def __aenter__(self):
+        app = web.Application()
+        app.router.add_get("/live", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}/live"
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.runner.cleanup()
+
+
+def test_regex_fast_path_matches_soup_fallback():
+    for html in (recorded_page(), page_with_score("185-10", "20.0"), page_with_score("8-0", "0.5")):
+        assert API.SCORE_PATTERN.search(html), "fast path should handle the recorded layout"
+        assert API.extract_score(html) == soup_score(html)
+
+
+def test_soup_fallback_when_regex_misses(monkeypatch):
+    html = recorded_page()
+    monkeypatch.setattr(API, "SCORE_PATTERN", re.compile(r"(?!)"))
+    assert API.extract_score(html) == "70-310.2"
+    event = parse_score(API.extract_score(html))
+    assert (event.runs, event.wickets, event.overs) == (70, 3, "10.2")
+
+
+def test_fetch_revalidates_with_etag():
+    async def scenario():
+        async with StandIn(recorded_page(), '"v1"') as server, aiohttp.ClientSession() as session:
+            fetcher = API.ScoreFetcher(server.url, session, min_interval=0)
+            first = await fetcher.fetch()
+            again = await fetcher.fetch()
+            server.html, server.etag = page_with_score("73-3", "11.0"), '"v2"'
+            changed = await fetcher.fetch()
+            return server.requests, first, again, changed
+
+    requests, first, again, changed = asyncio.run(scenario())
+    assert first == again == "70-310.2"
+    assert changed == "73-311.0"
+    assert "If-None-Match" not in requests[0]
+    assert requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_unparsable_page_is_not_revalidated():
+    async def scenario():
+        async with StandIn("<html><body>Match starts soon</body></html>", '"broken"') as server, \
+                aiohttp.ClientSession() as session:
+            fetcher = API.ScoreFetcher(server.url, session, min_interval=0)
+            for _ in range(2):
+                try:
+                    await fetcher.fetch()
+                except RuntimeError:
+                    pass
+            server.html, server.etag = recorded_page(), '"v1"'
+            score = await fetcher.fetch()
+            return server.requests, fetcher.etag, score
+
+    requests, etag, score = asyncio.run(scenario())
+    # The broken page's ETag was never sent back, so it could not be answered with a 304
+    assert all("If-None-Match" not in headers for headers in requests)
+    assert etag == '"v1"' and score == "70-310.2"
+
+
+def test_poller_appends_completed_overs(tmp_path, monkeypatch):
+    monkeypatch.setattr(API, "notify", lambda match_id: None)
+    stream = tmp_path / "live_score_test.csv"
+    match = {"match_id": "test", "url": None, "csv": str(stream), "min_interval": 0}
+
+    async def scenario():
+        async with StandIn(page_with_score("70-3", "10.5"), None) as server, aiohttp.ClientSession() as session:
+            match["url"] = server.url
+            poller = API.MatchPoller(match, session)
+            for score, overs in (("70-3", "10.5"), ("73-3", "11.0"), ("73-3", "11.0"), ("74-3", "11.1")):
+                server.html = page_with_score(score, overs)
+                poller.record(await poller.fetcher.fetch())
+
+    asyncio.run(scenario())
+    with open(stream, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [["score", "overs", "innings"], ["73-3", "11.0", "1"]]
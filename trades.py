@@ -0,0 +1,125 @@
+import asyncio
+
+
+class TradeError(Exception):
+    """A trade was rejected; the message is safe to show to the user"""
+
+
+class Trade:
+    __slots__ = ("kind", "guild_id", "user_id", "question_id", "option", "shares", "future")
+
+    def __init__(self, kind, guild_id, user_id, question_id, option, shares, future):
+        self.kind = kind
+        self.guild_id = guild_id
+        self.user_id = user_id
+        self.question_id = question_id
+        self.option = option
+        self.shares = shares
+        self.future = future
+
+
+class TradeQueue:
+    """
+    Single writer for all trade mutations.
+    Callers submit trades and await their fill; one worker task drains the
+    queue and applies each batch inside one transaction (group commit).
+    A batch is flushed once it reaches max_batch trades or max_delay seconds
+    after its first trade, whichever comes first. `journal` (the market
+    engine) is told when each batch begins, commits or fails, so in-memory
+    state changed by the batch can be undone with it.
+    """
+
+    def __init__(self, database, apply_trade, max_batch=64, max_delay=0.005, journal=None):
+        self.database = database
+        self.apply_trade = apply_trade  # async (db, trade) -> fill, raises TradeError
+        self.journal = journal  # begin() / commit() / rollback(), or None
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Apply everything already queued, then stop the worker"""
+        if self._worker is None:
+            return
+        await self._queue.put(None)
+        await self._worker
+        self._worker = None
+
+    async def submit(self, kind, guild_id, user_id, question_id, option, shares):
+        """Queue a trade and wait for its fill (raises TradeError on rejection)"""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(Trade(kind, guild_id, user_id, question_id, option, shares, future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    trade = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if trade is None:
+                    stopping = True
+                    break
+                batch.append(trade)
+            await self._apply(batch)
+
+    async def _apply(self, batch):
+        results = []
+        try:
+            async with self.database.writer() as db:
+                if self.journal is not None:
+                    self.journal.begin()
+                try:
+                    await db.execute("BEGIN IMMEDIATE")
+                    for trade in batch:
+                        # A savepoint per trade keeps one rejection from undoing the batch
+                        await db.execute("SAVEPOINT trade")
+                        try:
+                            fill = await self.apply_trade(db, trade)
+                        except Exception as e:
+                            await db.execute("ROLLBACK TO trade")
+                            await db.execute("RELEASE trade")
+                            results.append((trade, None, e))
+                        else:
+                            await db.execute("RELEASE trade")
+                            results.append((trade, fill, None))
+                    await db.commit()
+                except Exception:
+                    # Undo the batch's fills before anyone else can use the writer
+                    if self.journal is not None:
+                        self.journal.rollback()
+                    await db.rollback()
+                    raise
+                if self.journal is not None:
+                    self.journal.commit()
+        except Exception as e:
+            print(f"Trade batch of {len(batch)} failed: {str(e)}")
+            for trade in batch:
+                if not trade.future.done():
+                    trade.future.set_exception(e)
+            return
+
+        # Only report fills once they are durable
+        for trade, fill, error in results:
+            if trade.future.done():
+                continue
+            if error is not None:
+                trade.future.set_exception(error)
+            else:
+                trade.future.set_result(fill)
@@ -0,0 +1,51 @@
+import asyncio
+from collections import OrderedDict
+
+
+class ViewCache:
+    """
+    LRU cache of rendered embed payloads (Embed.to_dict()).
+    Entries are keyed by view and tagged with the caller's version, so a
+    lookup with a newer version re-renders. Concurrent lookups for the same
+    key and version share one render (and its database query).
+    invalidate() drops a key outright, e.g. on resolution or expiry.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (version, generation, payload)
+        self._generations = {}  # key -> bumped on every invalidate()
+        self._inflight = {}  # (key, version, generation) -> task
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key, version, render):
+        """Cached payload for key at version, rendering with `await render()` on a miss"""
+        generation = self._generations.get(key, 0)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version and entry[1] == generation:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+        self.misses += 1
+        flight = (key, version, generation)
+        task = self._inflight.get(flight)
+        if task is None:
+            task = asyncio.ensure_future(render())
+            self._inflight[flight] = task
+            task.add_done_callback(lambda _: self._inflight.pop(flight, None))
+        # Shield so one cancelled caller doesn't cancel the shared render
+        payload = await asyncio.shield(task)
+
+        # Don't store a render that an invalidation overtook, or "not found"
+        if payload is not None and self._generations.get(key, 0) == generation:
+            self._entries[key] = (version, generation, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return payload
+
+    def invalidate(self, key):
+        self._generations[key] = self._generations.get(key, 0) + 1
+        self._entries.pop(key, None)